@@ -14,7 +14,6 @@ except ImportError:
 
 from sync_app.file_info import FileInfo
 from sync_app.file_list import FileList
-from sync_app.util import run_command
 
 
 class FileListCache(object):
@@ -24,6 +23,8 @@ class FileListCache(object):
         self.pickle_file = pickle_file
         self.__cache_file_list_dict = {}
         self.cache_file_list_dict = {}
+        self.cached_tuples = {}
+        self.tuples_read = False
 
     @property
     def cache_file_list_dict(self):
@@ -56,23 +57,41 @@ class FileListCache(object):
         """ write python object to gzipped pickle file """
         with gzip.open('%s.tmp' % self.pickle_file, 'wb') as pkl_file:
             pickle.dump(inpobj, pkl_file, pickle.HIGHEST_PROTOCOL)
-        run_command('mv %s.tmp %s' % (self.pickle_file, self.pickle_file))
+        os.rename('%s.tmp' % self.pickle_file, self.pickle_file)
         return True
 
+    def read_cache_tuples(self):
+        """ read cached tuples, by filename """
+        temp_ = self.read_pickle_object_in_file()
+        if temp_:
+            for tup_ in temp_:
+                self.cached_tuples[tup_[0]] = tup_
+        self.tuples_read = True
+        return self.cached_tuples
+
     def get_cache_file_list(self,
                             file_list_obj=None,
                             file_info_class=FileInfo,
-                            file_list_class=FileList):
-        """ read list from cache file """
+                            file_list_class=FileList,
+                            directory=None):
+        """
+            read list from cache file,
+            only entries below directory are turned into file_info_class objects if given
+        """
         if not file_list_obj:
             file_list_obj = file_list_class()
-        temp_ = self.read_pickle_object_in_file()
-        if temp_:
-            for tup_ in temp_:
-                finf_ = file_info_class(in_tuple=tup_)
-                fn_ = finf_.filename
-                self.cache_file_list_dict[fn_] = finf_
-                file_list_obj.append(finf_)
+        if not self.tuples_read:
+            self.read_cache_tuples()
+        prefix = None
+        if directory is not None:
+            prefix = '%s/' % os.path.abspath(directory).rstrip('/')
+        for tup_ in self.cached_tuples.values():
+            if prefix and not tup_[0].startswith(prefix):
+                continue
+            finf_ = file_info_class(in_tuple=tup_)
+            fn_ = finf_.filename
+            self.cache_file_list_dict[fn_] = finf_
+            file_list_obj.append(finf_)
         return file_list_obj
 
     def add_filelist_to_cache(self, file_list=None):
@@ -82,16 +101,19 @@ class FileListCache(object):
         for fileinfo in file_list:
             fn_ = fileinfo.filename
             self.cache_file_list_dict[fn_] = fileinfo
+            self.cached_tuples[fn_] = fileinfo.output_cache_tuple()
         return True
 
     def write_cache_file_list(self, file_list=None):
-        """ write file_list to cache pickle file """
+        """
+            write file_list to cache pickle file, together with every other cached entry,
+            cache_file_list_dict only holds the subtrees which were loaded
+        """
+        if not self.tuples_read:
+            self.read_cache_tuples()
         if file_list:
             self.add_filelist_to_cache(file_list)
-        cache_list = []
-        for finfo in self.cache_file_list_dict.values():
-            cache_list.append(finfo.output_cache_tuple())
-        return self.write_pickle_object_to_file(tuple(cache_list))
+        return self.write_pickle_object_to_file(tuple(self.cached_tuples.values()))
 
 
 def test_file_list_cache():
@@ -0,0 +1,160 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    FileListCacheRemote class, cache remote (gdrive, box, onedrive) metadata in sqlite,
+    entries are keyed by backend and remote id and keep the folder topology (parent ids),
+    an etag/checksum/modification time version tells whether a cached entry is still valid,
+    gdrive keeps its own index (raw items and changes page token) instead
+"""
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import sqlite3
+from collections import namedtuple, OrderedDict
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+VERSION_FIELDS = ('etag', 'eTag', 'sha1', 'modified_at', 'lastModifiedDateTime')
+
+CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS remote_info (
+        backend TEXT,
+        remote_id TEXT,
+        parentid TEXT,
+        is_folder INTEGER,
+        version TEXT,
+        data BLOB,
+        PRIMARY KEY (backend, remote_id)
+    ) WITHOUT ROWID
+"""
+
+RemoteEntry = namedtuple('RemoteEntry', ['parentid', 'is_folder', 'version', 'cache_tuple'])
+
+
+def get_item_version(item):
+    """ version of an api item, changes whenever the item (content, name or parent) changes """
+    return ':'.join('%s' % item[key] for key in VERSION_FIELDS if item.get(key))
+
+
+def strip_instance(cache_tuple):
+    """ the api instance is the last field of each remote output_cache_tuple, it can't be stored """
+    return tuple(cache_tuple[:-1]) + (None, )
+
+
+class FileListCacheRemote(object):
+    """ class to manage caching remote file lists in sqlite """
+
+    def __init__(self, sqlite_file=''):
+        self.sqlite_file = sqlite_file
+        self.cached_entries = {}
+        self._conn = None
+
+    @property
+    def conn(self):
+        """ open database and create schema on first use """
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.sqlite_file)
+            self._conn.execute(CREATE_TABLE)
+            columns = [row[1] for row in self._conn.execute('PRAGMA table_info(remote_info)')]
+            if 'version' not in columns:
+                self._conn.execute('ALTER TABLE remote_info ADD COLUMN version TEXT')
+        return self._conn
+
+    def close(self):
+        """ close database """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def read_entries(self, backend):
+        """ {remote_id: RemoteEntry} of backend, folders first """
+        output = OrderedDict()
+        for remote_id, parentid, is_folder, version, data in self.conn.execute(
+                'SELECT remote_id, parentid, is_folder, version, data FROM remote_info '
+                'WHERE backend = ? ORDER BY is_folder DESC', (backend, )):
+            entry = RemoteEntry(parentid, bool(is_folder), version, pickle.loads(bytes(data)))
+            self.cached_entries[(backend, remote_id)] = entry
+            output[remote_id] = entry
+        return output
+
+    def write_entries(self, backend, entries, complete=False):
+        """
+            write entries ({remote_id: RemoteEntry}) of backend,
+            only rows which differ from what was read or written before are touched,
+            an entry with the version and path it was cached with is taken as unchanged,
+            complete: entries is a full listing, cached entries missing from it are deleted
+        """
+        rows = []
+        for remote_id, entry in entries.items():
+            cached = self.cached_entries.get((backend, remote_id))
+            if cached is not None and entry.version and cached.version == entry.version and \
+                    cached.parentid == entry.parentid and \
+                    cached.cache_tuple[0] == entry.cache_tuple[0]:
+                continue
+            entry = entry._replace(cache_tuple=strip_instance(entry.cache_tuple))
+            if cached == entry:
+                continue
+            self.cached_entries[(backend, remote_id)] = entry
+            rows.append((backend, remote_id, entry.parentid, int(entry.is_folder), entry.version,
+                         sqlite3.Binary(pickle.dumps(entry.cache_tuple, protocol=2))))
+        missing = []
+        if complete:
+            missing = [(backend, remote_id)
+                       for remote_id, in self.conn.execute(
+                           'SELECT remote_id FROM remote_info WHERE backend = ?', (backend, ))
+                       if remote_id not in entries]
+        for key in missing:
+            self.cached_entries.pop(key, None)
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO remote_info '
+            '(backend, remote_id, parentid, is_folder, version, data) VALUES (?, ?, ?, ?, ?, ?)',
+            rows)
+        self.conn.executemany('DELETE FROM remote_info WHERE backend = ? AND remote_id = ?',
+                              missing)
+        self.conn.commit()
+        return len(rows) + len(missing)
+
+
+def test_file_list_cache_remote():
+    """ test FileListCacheRemote """
+    import os
+    import tempfile
+
+    assert get_item_version({'id': 'x', 'etag': '3', 'modified_at': '2016'}) == '3:2016'
+    assert strip_instance(('a', 1, object())) == ('a', 1, None)
+
+    tmpdir = tempfile.mkdtemp()
+    conn = sqlite3.connect('%s/remote.sqlite' % tmpdir)
+    # a database without the version column
+    conn.execute('CREATE TABLE remote_info (backend TEXT, remote_id TEXT, parentid TEXT, '
+                 'is_folder INTEGER, data BLOB, PRIMARY KEY (backend, remote_id)) WITHOUT ROWID')
+    conn.close()
+    fcache = FileListCacheRemote(sqlite_file='%s/remote.sqlite' % tmpdir)
+    entries = OrderedDict([
+        ('f1', RemoteEntry('d1', False, '1', ('/a/b/x.txt', {'pdf': 'url'}, object()))),
+        ('d1', RemoteEntry('0', True, '2', ('/a/b', None))),
+    ])
+    assert fcache.write_entries('box', entries) == 2
+    assert fcache.write_entries('onedrive', {'d1': RemoteEntry('root', True, '', ('x', None))}) == 1
+    assert fcache.write_entries('box', entries) == 0
+    fcache.close()
+
+    fcache = FileListCacheRemote(sqlite_file='%s/remote.sqlite' % tmpdir)
+    tmp = fcache.read_entries('box')
+    assert list(tmp) == ['d1', 'f1']
+    assert tmp['f1'] == RemoteEntry('d1', False, '1', ('/a/b/x.txt', {'pdf': 'url'}, None))
+    # same version and path: unchanged, whatever else was listed
+    entries['f1'] = RemoteEntry('d1', False, '1', ('/a/b/x.txt', {}, object()))
+    assert fcache.write_entries('box', entries) == 0
+    entries['f1'] = RemoteEntry('d1', False, '1', ('/a/c/x.txt', {}, object()))
+    assert fcache.write_entries('box', entries) == 1
+    entries.pop('f1')
+    # a partial listing doesn't drop the entries it doesn't contain
+    assert fcache.write_entries('box', entries) == 0
+    assert list(fcache.read_entries('box')) == ['d1', 'f1']
+    assert fcache.write_entries('box', entries, complete=True) == 1
+    assert list(fcache.read_entries('box')) == ['d1']
+    assert list(fcache.read_entries('onedrive')) == ['d1']
+    os.remove('%s/remote.sqlite' % tmpdir)
+    os.rmdir(tmpdir)
@@ -0,0 +1,247 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    FileListCacheSqlite class, cache FileInfo objects in an indexed sqlite database,
+    rows are clustered by path so loading a subtree reads contiguous pages
+"""
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import os
+import sqlite3
+
+from sync_app.util import to_digest
+from sync_app.file_info import FileInfo
+from sync_app.file_list import FileList
+
+CACHE_COLUMNS = ('filename', 'urlname', 'md5sum', 'sha1sum', 'st_mtime', 'st_size', 'fingerprint',
+                 'st_dev', 'st_ino')
+INDEX_COLUMNS = ('basename', 'md5sum', 'sha1sum', 'st_size', 'st_ino')
+
+CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS file_info (
+        filename TEXT PRIMARY KEY,
+        basename TEXT,
+        urlname TEXT,
+        md5sum TEXT,
+        sha1sum TEXT,
+        st_mtime INTEGER,
+        st_size INTEGER,
+        fingerprint TEXT,
+        st_dev INTEGER,
+        st_ino INTEGER
+    ) WITHOUT ROWID
+"""
+
+CREATE_DIRECTORY_TABLE = """
+    CREATE TABLE IF NOT EXISTS directory_info (
+        dirname TEXT PRIMARY KEY,
+        st_mtime INTEGER,
+        files TEXT,
+        subdirs TEXT
+    ) WITHOUT ROWID
+"""
+
+
+def get_prefix_range(directory):
+    """ [lower, upper) bounds of every path below directory, usable by the primary key index """
+    directory = directory.rstrip('/')
+    return '%s/' % directory, '%s0' % directory
+
+
+class FileListCacheSqlite(object):
+    """
+        class to manage caching objects in sqlite,
+        rows are keyed by absolute path, writes only touch changed rows
+    """
+
+    def __init__(self, sqlite_file=''):
+        self.sqlite_file = sqlite_file
+        self.cached_tuples = {}
+        self._conn = None
+
+    @property
+    def conn(self):
+        """ open database and create schema on first use """
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.sqlite_file)
+            self._conn.execute(CREATE_TABLE)
+            # databases written before a column was added
+            existing = set(row[1] for row in self._conn.execute('PRAGMA table_info(file_info)'))
+            for col, coltype in (('st_dev', 'INTEGER'), ('st_ino', 'INTEGER')):
+                if col not in existing:
+                    self._conn.execute('ALTER TABLE file_info ADD COLUMN %s %s' % (col, coltype))
+            self._conn.execute(CREATE_DIRECTORY_TABLE)
+            for col in INDEX_COLUMNS:
+                self._conn.execute('CREATE INDEX IF NOT EXISTS file_info_%s ON file_info (%s)' %
+                                   (col, col))
+        return self._conn
+
+    def close(self):
+        """ close database """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def read_cache_tuples(self, directory=None):
+        """ read rows, restricted to the subtree(s) below directory if given """
+        query = 'SELECT %s FROM file_info' % ', '.join(CACHE_COLUMNS)
+        if directory is None:
+            return self.conn.execute(query).fetchall()
+        directories = directory if isinstance(directory, (list, tuple)) else [directory]
+        output = []
+        for direc in directories:
+            output.extend(
+                self.conn.execute(query + ' WHERE filename >= ? AND filename < ?',
+                                  get_prefix_range(os.path.abspath(direc))).fetchall())
+        return output
+
+    def find_cache_tuples(self, **kwargs):
+        """
+            indexed lookup, e.g. find_cache_tuples(basename='cover.jpg', st_size=1234),
+            digests are stored raw, hex digests are converted
+        """
+        for key in kwargs:
+            if key not in INDEX_COLUMNS + ('filename', ):
+                raise ValueError('%s is not indexed' % key)
+            if key in ('md5sum', 'sha1sum'):
+                kwargs[key] = to_digest(kwargs[key])
+        keys = sorted(kwargs)
+        query = 'SELECT %s FROM file_info WHERE %s' % (', '.join(CACHE_COLUMNS), ' AND '.join(
+            '%s = ?' % key for key in keys))
+        return self.conn.execute(query, [kwargs[key] for key in keys]).fetchall()
+
+    def get_cache_file_list(self,
+                            file_list_obj=None,
+                            file_info_class=FileInfo,
+                            file_list_class=FileList,
+                            directory=None):
+        """ read list from cache database, only the subtree(s) below directory if given """
+        if not file_list_obj:
+            file_list_obj = file_list_class()
+        for tup_ in self.read_cache_tuples(directory=directory):
+            tup_ = tuple('' if val is None else val for val in tup_)
+            self.cached_tuples[tup_[0]] = tup_
+            file_list_obj.append(file_info_class(in_tuple=tup_))
+        return file_list_obj
+
+    def add_filelist_to_cache(self, file_list=None):
+        """ upsert and commit entries of file_list which differ from what was read """
+        if file_list is None:
+            return False
+        rows = []
+        for fileinfo in file_list:
+            tup_ = tuple(fileinfo.output_cache_tuple())
+            tup_ = tup_ + ('', ) * (len(CACHE_COLUMNS) - len(tup_))
+            if self.cached_tuples.get(tup_[0]) == tup_:
+                continue
+            self.cached_tuples[tup_[0]] = tup_
+            rows.append(tup_[:1] + (os.path.basename(tup_[0]), ) + tup_[1:])
+        if rows:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO file_info (filename, basename, %s) ' %
+                ', '.join(CACHE_COLUMNS[1:]) + 'VALUES (%s)' % ', '.join('?' * len(rows[0])),
+                rows)
+            self.conn.commit()
+        return True
+
+    def delete_from_cache(self, filenames):
+        """ delete entries by absolute path """
+        filenames = list(filenames)
+        for fn_ in filenames:
+            self.cached_tuples.pop(fn_, None)
+        self.conn.executemany('DELETE FROM file_info WHERE filename = ?',
+                              [(fn_, ) for fn_ in filenames])
+        return len(filenames)
+
+    def get_directory_info(self, directory):
+        """
+            {dirname: (st_mtime_ns, files, subdirs)} for directory and the directories below it,
+            names are joined by '/' which can't appear in a file name
+        """
+        directory = os.path.abspath(directory)
+        query = 'SELECT dirname, st_mtime, files, subdirs FROM directory_info ' + \
+                'WHERE dirname = ? OR (dirname >= ? AND dirname < ?)'
+        output = {}
+        for dirname, mtime, files, subdirs in self.conn.execute(
+                query, (directory, ) + get_prefix_range(directory)):
+            output[dirname] = (mtime, files.split('/') if files else [],
+                               subdirs.split('/') if subdirs else [])
+        return output
+
+    def add_directory_info(self, directory_info):
+        """ upsert and commit {dirname: (st_mtime_ns, files, subdirs)} """
+        rows = [(dirname, mtime, '/'.join(files), '/'.join(subdirs))
+                for dirname, (mtime, files, subdirs) in directory_info.items()]
+        if rows:
+            self.conn.executemany('INSERT OR REPLACE INTO directory_info VALUES (?, ?, ?, ?)', rows)
+            self.conn.commit()
+        return len(rows)
+
+    def remove_missing(self, file_list, directory):
+        """ delete cached entries (and directories) below directory which are not in file_list """
+        missing = [
+            tup_[0] for tup_ in self.read_cache_tuples(directory=directory)
+            if tup_[0] not in file_list.filelist
+        ]
+        if hasattr(file_list, 'directory_info'):
+            directories = directory if isinstance(directory, (list, tuple)) else [directory]
+            for direc in directories:
+                missing_dirs = [(dirname, ) for dirname in self.get_directory_info(direc)
+                                if dirname not in file_list.directory_info]
+                self.conn.executemany('DELETE FROM directory_info WHERE dirname = ?',
+                                      missing_dirs)
+        return self.delete_from_cache(missing)
+
+    def write_cache_file_list(self, file_list=None, directory=None):
+        """
+            upsert changed entries of file_list and commit,
+            if directory is given entries below it missing from file_list are deleted
+        """
+        if file_list:
+            self.add_filelist_to_cache(file_list)
+            if directory is not None:
+                self.remove_missing(file_list, directory)
+        self.conn.commit()
+        return True
+
+
+def test_file_list_cache_sqlite():
+    """ test FileListCacheSqlite """
+    import tempfile
+    from nose.tools import raises
+    from sync_app.file_info import StatTuple
+
+    tmpdir = tempfile.mkdtemp()
+    fcache = FileListCacheSqlite(sqlite_file='%s/cache.sqlite' % tmpdir)
+    assert fcache.add_filelist_to_cache() is False
+
+    @raises(TypeError)
+    def test_tmp():
+        """ nose test """
+        fcache.add_filelist_to_cache(file_list=1)
+
+    test_tmp()
+
+    flist = FileList()
+    for fn_, size in (('/a/b/x.txt', 10), ('/a/b/c/y.txt', 20), ('/a/bc/z.txt', 30)):
+        flist.append(FileInfo(fn=fn_, md5='%032x' % size, fs=StatTuple(st_size=size)))
+    fcache.write_cache_file_list(flist)
+    fcache.close()
+
+    fcache = FileListCacheSqlite(sqlite_file='%s/cache.sqlite' % tmpdir)
+    tmp = fcache.get_cache_file_list(directory='/a/b')
+    assert sorted(tmp.filelist) == ['/a/b/c/y.txt', '/a/b/x.txt']
+    assert tmp['/a/b/x.txt'].md5sum == '%032x' % 10
+    assert [x[0] for x in fcache.find_cache_tuples(basename='z.txt')] == ['/a/bc/z.txt']
+    assert [x[0] for x in fcache.find_cache_tuples(md5sum='%032x' % 30)] == ['/a/bc/z.txt']
+
+    tmp = FileList()
+    tmp.append(FileInfo(fn='/a/b/x.txt', md5='%032x' % 10, fs=StatTuple(st_size=11)))
+    fcache.write_cache_file_list(tmp, directory='/a/b')
+    assert [x[5] for x in fcache.read_cache_tuples('/a/b')] == [11]
+    assert len(fcache.read_cache_tuples()) == 2
+
+    fcache.add_directory_info({'/a/b': (12, ['x.txt'], ['c']), '/a/bc': (13, [], [])})
+    assert fcache.get_directory_info('/a/b') == {'/a/b': (12, ['x.txt'], ['c'])}
+    os.remove('%s/cache.sqlite' % tmpdir)
+    os.rmdir(tmpdir)
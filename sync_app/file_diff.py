@@ -0,0 +1,225 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    comparison of two FileList objects, used by FileSync,
+    names are matched with set algebra, then sizes and mtimes are compared,
+    digests are only computed for the few ambiguous pairs
+"""
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import os
+from collections import namedtuple
+
+from sync_app.util import MIMETYPE_SUFFIXES, GOOGLEAPP_MIMETYPES, to_digest
+
+MTIME_SLOP = 12 * 3600
+
+FileDiff = namedtuple('FileDiff', ['a_not_b', 'b_not_a', 'modified'])
+
+
+def is_doubled_extension(fn_, names):
+    """ x.pdf.pdf is considered the same file as x.pdf if that exists """
+    tmp = fn_.split('.')[-2:]
+    return len(tmp) > 1 and tmp[0] == tmp[1] and fn_.rsplit('.', 1)[0] in names
+
+
+def has_local_export(finfos):
+    """ google apps documents exist locally as the exported file """
+    for finf in finfos:
+        mtype = getattr(finf, 'mimetype', '')
+        if 'application/vnd.google-apps' in mtype:
+            ext = MIMETYPE_SUFFIXES.get(GOOGLEAPP_MIMETYPES.get(mtype))
+            if os.path.exists(finf.filename) or os.path.exists('%s.%s' % (finf.filename, ext)):
+                return True
+    return False
+
+
+def get_newer(mtimes0, mtimes1, mtime_slop=MTIME_SLOP):
+    """ indices where mtimes0 is newer than mtimes1 by more than mtime_slop """
+    return [idx for idx, (mt0, mt1) in enumerate(zip(mtimes0, mtimes1)) if mt0 > mt1 + mtime_slop]
+
+
+def get_match_dict(flist, match_relpath=False):
+    """ dict files are matched by, basename -> [FileInfo] or relative path -> FileInfo """
+    return flist.filelist_relpath_dict if match_relpath else flist.filelist_name_dict
+
+
+def get_matches(match_dict, key):
+    """ [FileInfo] of key in a dict returned by get_match_dict """
+    val = match_dict.get(key)
+    if val is None:
+        return []
+    return val if isinstance(val, list) else [val]
+
+
+def get_firsts(flist, match_relpath=False):
+    """ {key: first FileInfo} of the non-empty keys of get_match_dict(flist, match_relpath) """
+    if match_relpath:
+        return dict(flist.filelist_relpath_dict.items())
+    return {key: val[0] for key, val in flist.filelist_name_dict.items() if val}
+
+
+def get_digest(finfo, htype):
+    """ raw digest of finfo, computed if needed """
+    if hasattr(finfo, 'get_digests'):
+        return to_digest(finfo.get_digests((htype, ))[htype])
+    return to_digest(getattr(finfo, '%ssum' % htype, ''))
+
+
+def queue_digest(finfo, htype, stats=None):
+    """ queue lazy digest computation, count files which actually need hashing in stats """
+    if hasattr(finfo, 'submit_hashes') and finfo.submit_hashes((htype, )) and stats is not None:
+        stats['hashed'] += 1
+
+
+def filter_fingerprints(finfo, matches, stats=None):
+    """
+        drop matches whose partial-content fingerprint differs from finfo's,
+        only possible when both sides are local files, count computed fingerprints in stats
+    """
+    if not hasattr(finfo, 'get_fingerprint'):
+        return matches
+    output = []
+    for finf in matches:
+        if hasattr(finf, 'get_fingerprint'):
+            if stats is not None:
+                stats['fingerprinted'] += sum(1 for obj in (finfo, finf) if not obj.fingerprint)
+            if finf.get_fingerprint() != finfo.get_fingerprint():
+                continue
+        output.append(finf)
+    return output
+
+
+def iter_diff(flist0, flist1, use_sha1=False, mtime_slop=MTIME_SLOP, match_relpath=False,
+              stats=None):
+    """
+        compare flist0 against flist1 by file name (or relative path),
+        yield (action, FileInfo0, FileInfo1) as soon as each is decided:
+            ('a_not_b', finfo0, None) only in flist0
+            ('modified', finfo0, finfo1) newer in flist0 with different contents
+            ('b_not_a', finfo1, None) only in flist1
+        contents are only compared (hashed) when a file of the same size (and fingerprint)
+        exists in flist1, those digests are queued together and compared last,
+        stats ({'hashed': 0, 'fingerprinted': 0}) counts the work done
+    """
+    htype = 'sha1' if use_sha1 else 'md5'
+    names0 = get_match_dict(flist0, match_relpath)
+    names1 = get_match_dict(flist1, match_relpath)
+    # the actions may be run while this goes on and add files, work on copies
+    firsts0 = get_firsts(flist0, match_relpath)
+    firsts1 = get_firsts(flist1, match_relpath)
+    keys0 = set(firsts0)
+    keys1 = set(firsts1)
+
+    for key in sorted(keys0 - keys1):
+        finfos = get_matches(names0, key)
+        if is_doubled_extension(key, keys0) or has_local_export(finfos):
+            continue
+        yield 'a_not_b', finfos[0], None
+
+    common = list(keys0 & keys1)
+    # mtimes are compared as two columns, only the (few) newer keys are sorted
+    newer = [(firsts0[key], firsts1[key]) for key in sorted(
+        common[idx]
+        for idx in get_newer([firsts0[key].filestat.st_mtime for key in common],
+                             [firsts1[key].filestat.st_mtime for key in common], mtime_slop))]
+
+    ambiguous = []
+    for finfo0, finfo1 in newer:
+        size0 = finfo0.filestat.st_size
+        # only files of the same size can hold finfo0's contents
+        matches = list(flist1.get_size_candidates(size0)) if size0 else []
+        if (not size0 or not finfo1.filestat.st_size) and finfo1 not in matches:
+            # unknown size, compare directly
+            matches.append(finfo1)
+        matches = filter_fingerprints(finfo0, matches, stats)
+        if not matches:
+            yield 'modified', finfo0, finfo1
+            continue
+        for finf in [finfo0] + matches:
+            queue_digest(finf, htype, stats)
+        ambiguous.append((finfo0, finfo1, matches))
+
+    hash_dict = flist1.filelist_sha1_dict if use_sha1 else flist1.filelist_md5_dict
+    for finfo0, finfo1, matches in ambiguous:
+        digest0 = get_digest(finfo0, htype)
+        if digest0 in hash_dict:
+            continue
+        if any(digest0 == get_digest(finf, htype) for finf in matches):
+            continue
+        yield 'modified', finfo0, finfo1
+
+    for key in sorted(keys1 - keys0):
+        finfos = get_matches(names1, key)
+        if is_doubled_extension(key, keys0):
+            continue
+        if any(finf.filename in flist0.filelist for finf in finfos):
+            continue
+        yield 'b_not_a', finfos[0], None
+
+
+def diff_file_lists(flist0, flist1, use_sha1=False, mtime_slop=MTIME_SLOP, match_relpath=False):
+    """ FileDiff of iter_diff, modified is sorted by filename """
+    output = FileDiff(a_not_b=[], b_not_a=[], modified=[])
+    for action, finfo0, finfo1 in iter_diff(flist0, flist1, use_sha1=use_sha1,
+                                            mtime_slop=mtime_slop, match_relpath=match_relpath):
+        getattr(output, action).append((finfo0, finfo1) if action == 'modified' else finfo0)
+    output.modified.sort(key=lambda pair: pair[0].filename)
+    return output
+
+
+def test_diff_file_lists():
+    """ test diff_file_lists """
+    from sync_app.file_info import FileInfo, StatTuple
+    from sync_app.file_list import FileList
+
+    flist0 = FileList()
+    flist1 = FileList()
+    for fn_, md5, mtime, size in (('/a/same.txt', 'a', 0, 1), ('/a/new.txt', 'b', 0, 1),
+                                  ('/a/old.txt', 'c', 2**30, 2), ('/a/moved.txt', 'd', 2**30, 3),
+                                  ('/a/changed.txt', 'e', 2**30, 4), ('/a/resized.txt', 'f',
+                                                                      2**30, 9)):
+        flist0.append(FileInfo(fn=fn_, md5=md5 * 32, fs=StatTuple(st_mtime=mtime, st_size=size)))
+    for fn_, md5, mtime, size in (('/b/same.txt', 'a', 0, 1), ('/b/old.txt', 'c', 0, 2),
+                                  ('/b/moved.txt', '0', 0, 3), ('/b/x/moved.txt', 'd', 0, 3),
+                                  ('/b/changed.txt', '1', 0, 4), ('/b/resized.txt', 'f', 0, 8),
+                                  ('/b/only.txt', '2', 0, 5), ('/b/new.txt.txt', '3', 0, 1)):
+        flist1.append(FileInfo(fn=fn_, md5=md5 * 32, fs=StatTuple(st_mtime=mtime, st_size=size)))
+    flist0.fill_hash_dicts()
+    flist1.fill_hash_dicts()
+
+    diff = diff_file_lists(flist0, flist1)
+    assert [x.filename for x in diff.a_not_b] == ['/a/new.txt']
+    assert [x.filename for x in diff.b_not_a] == ['/b/only.txt']
+    assert [(x.filename, y.filename) for x, y in diff.modified] == [
+        ('/a/changed.txt', '/b/changed.txt'), ('/a/resized.txt', '/b/resized.txt')
+    ]
+    assert get_newer([0, 10, 20], [0, 0, 0], mtime_slop=5) == [1, 2]
+
+
+def test_diff_file_lists_timing(nfiles=5 * 10**4, max_seconds=2):
+    """ test diff_file_lists of two large lists, 10**6 files take 4-7s """
+    import time
+    from sync_app.file_info import FileInfo, StatTuple
+    from sync_app.file_list import FileList
+
+    flists = []
+    for side in range(2):
+        flist = FileList(basedir='/b%d' % side)
+        for idx in range(nfiles):
+            # every 100th file only in flist0, every 1000th newer in flist0 with other contents
+            if side == 1 and idx % 100 == 0:
+                continue
+            changed = side == 0 and idx % 1000 == 1
+            flist.append(
+                FileInfo(fn='/b%d/d%04d/f%07d.txt' % (side, idx // 1000, idx),
+                         md5='%032x' % (idx + changed * 10**7),
+                         fs=StatTuple(st_mtime=2**30 + changed * 10**6, st_size=idx)))
+        flist.fill_hash_dicts()
+        flists.append(flist)
+    for match_relpath in (False, True):
+        start = time.time()
+        diff = diff_file_lists(flists[0], flists[1], match_relpath=match_relpath)
+        assert time.time() - start < max_seconds
+        assert (len(diff.a_not_b), len(diff.b_not_a), len(diff.modified)) == \
+            (nfiles // 100, 0, nfiles // 1000)
@@ -4,14 +4,16 @@
     module containing FileInfo class.
     FileInfo:
         container for file metadata:
-            filename
+            filename (interned directory + basename)
             urlname
-            md5sum of the file
-            sha1sum of the file
+            md5sum of the file (stored as raw bytes, hex on access)
+            sha1sum of the file (stored as raw bytes, hex on access)
             output of os.stat
 """
 from __future__ import (absolute_import, division, print_function, unicode_literals)
 
+from sync_app.util import to_digest, to_hex, split_path, intern_directory
+
 STAT_ATTRS = ('st_mtime', 'st_size')
 FILE_INFO_SLOTS = ('filename', 'urlname', 'md5sum', 'sha1sum', 'filestat')
 
@@ -26,19 +28,11 @@ class StatTuple(object):
 
     def __init__(self, fs=None, **kwargs):
         """ Init function """
-        self.st_mtime = 0
-        self.st_size = 0
         for attr in STAT_ATTRS:
-            if attr in kwargs:
-                val = kwargs[attr]
-                setattr(self, attr, int(val))
-            else:
-                setattr(self, attr, 0)
-        if fs:
-            for attr in STAT_ATTRS:
-                if hasattr(fs, attr):
-                    val = getattr(fs, attr)
-                    setattr(self, attr, int(val))
+            val = getattr(fs, attr, None) if fs else None
+            if val is None:
+                val = kwargs.get(attr, 0)
+            setattr(self, attr, int(val))
 
     def __repr__(self):
         """ Nice pretty string representation """
@@ -50,14 +44,17 @@ class FileInfo(object):
         file info class, meant as a base for local/gdrive/s3,
         define common elements, hold common code
     """
-    __slots__ = list(FILE_INFO_SLOTS)
+    __slots__ = ['_dirname', '_basename', 'urlname', '_md5', '_sha1', 'filestat']
 
     def __init__(self, fn='', url='', md5=None, sha1=None, fs=None, in_tuple=None):
-        """ Init function, define sensible defaults """
+        """
+            Init function, define sensible defaults,
+            missing digests are left empty until get_md5/get_sha1/get_digests
+        """
         self.filename = fn
         self.urlname = url
-        self.md5sum = md5 if md5 else self.get_md5()
-        self.sha1sum = sha1 if sha1 else self.get_sha1()
+        self.md5sum = md5 if md5 else ''
+        self.sha1sum = sha1 if sha1 else ''
         self.filestat = StatTuple(fs) if fs else StatTuple(self.get_stat())
         if in_tuple:
             self.input_cache_tuple(in_tuple)
@@ -70,6 +67,49 @@ class FileInfo(object):
                'sha1=%s, ' % self.sha1sum + \
                'size=%s)>' % self.filestat.st_size
 
+    @property
+    def filename(self):
+        """ full path, files in the same directory share the directory string """
+        return self._dirname + self._basename
+
+    @filename.setter
+    def filename(self, val):
+        dname, self._basename = split_path(val)
+        self._dirname = intern_directory(dname)
+
+    @property
+    def basename(self):
+        """ file name without the directory """
+        return self._basename
+
+    @property
+    def md5sum(self):
+        """ hex md5, a pending result until resolved, '' if unknown """
+        return to_hex(self._md5)
+
+    @md5sum.setter
+    def md5sum(self, val):
+        self._md5 = to_digest(val) if val else ''
+
+    @property
+    def sha1sum(self):
+        """ hex sha1, a pending result until resolved, '' if unknown """
+        return to_hex(self._sha1)
+
+    @sha1sum.setter
+    def sha1sum(self, val):
+        self._sha1 = to_digest(val) if val else ''
+
+    @property
+    def md5_digest(self):
+        """ md5 as stored, raw bytes once known, used as hash dict key """
+        return self._md5
+
+    @property
+    def sha1_digest(self):
+        """ sha1 as stored, raw bytes once known, used as hash dict key """
+        return self._sha1
+
     def fill_stat(self, fs=None, **options):
         """ convert fs into StatTuple... """
         self.filestat = StatTuple(fs=fs, **options)
@@ -83,6 +123,20 @@ class FileInfo(object):
         self.sha1sum = ''
         return self.sha1sum
 
+    def get_digests(self, hash_types=('md5', 'sha1')):
+        """
+            return dict of requested digests, unknown or missing ones are empty,
+            meant to be overridden where digests can be computed
+        """
+        output = {}
+        for htype in hash_types:
+            digest = getattr(self, '%ssum' % htype, '') if htype in ('md5', 'sha1') else ''
+            if hasattr(digest, 'result'):
+                digest = digest.result()
+                setattr(self, '%ssum' % htype, digest)
+            output[htype] = digest if digest else ''
+        return output
+
     def get_stat(self):
         """ meant to be overridden """
         self.filestat = StatTuple()
@@ -94,13 +148,13 @@ class FileInfo(object):
             self.md5sum = self.md5sum.result()
         if hasattr(self.sha1sum, 'result'):
             self.sha1sum = self.sha1sum.result()
-        return (self.filename, self.urlname, self.md5sum, self.sha1sum, self.filestat.st_mtime,
+        return (self.filename, self.urlname, self._md5, self._sha1, self.filestat.st_mtime,
                 self.filestat.st_size)
 
     def input_cache_tuple(self, in_tuple):
-        """ deserialize FileInfo """
+        """ deserialize FileInfo, ignore trailing fields added by subclasses """
         self.filename, self.urlname, self.md5sum, self.sha1sum, \
-            self.filestat.st_mtime, self.filestat.st_size = in_tuple
+            self.filestat.st_mtime, self.filestat.st_size = in_tuple[:6]
 
 
 def test_stat_tuple():
@@ -140,3 +194,7 @@ def test_file_info():
             print(key, getattr(tmp, key))
             print(key, test[key])
             assert getattr(tmp, key) == test[key]
+    assert tmp.get_digests(('sha1', 'sha256')) == {'sha1': test['sha1sum'], 'sha256': ''}
+    assert len(tmp.md5_digest) == 16 and len(tmp.output_cache_tuple()[3]) == 20
+    assert FileInfo(in_tuple=tmp.output_cache_tuple()).sha1sum == test['sha1sum']
+    assert tmp._dirname is FileInfo(fn='tests/test_dir/goodbye_world.txt', fs=fs_)._dirname
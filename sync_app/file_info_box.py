@@ -13,7 +13,7 @@ from sync_app.file_info import FileInfo
 
 BASE_DIR = '%s/Box' % os.getenv('HOME')
 
-FILE_INFO_SLOTS = ('boxid', 'mimetype', 'exportpath', 'box', 'sha1sum', 'parentid')
+FILE_INFO_SLOTS = ('boxid', 'mimetype', 'exportpath', 'box', 'parentid')
 
 
 class FileInfoBox(FileInfo):
@@ -66,7 +66,7 @@ class FileInfoBox(FileInfo):
                'id=%s)>' % self.boxid
 
     def output_cache_tuple(self):
-        return (self.filename, self.urlname, self.sha1sum, self.filestat.st_mtime,
+        return (self.filename, self.urlname, self.sha1_digest, self.filestat.st_mtime,
                 self.filestat.st_size, self.boxid, self.mimetype, self.exportpath, self.box)
 
     def input_cache_tuple(self, in_tuple):
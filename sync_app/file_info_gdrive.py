@@ -83,7 +83,7 @@ class FileInfoGdrive(FileInfo):
                'isroot=%s)>' % self.isroot
 
     def output_cache_tuple(self):
-        return (self.filename, self.urlname, self.md5sum, self.filestat.st_mtime,
+        return (self.filename, self.urlname, self.md5_digest, self.filestat.st_mtime,
                 self.filestat.st_size, self.gdriveid, self.mimetype, self.parentid, self.exporturls,
                 self.exportpath, self.isroot, self.gdrive)
 
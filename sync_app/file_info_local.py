@@ -5,52 +5,387 @@
 """
 from __future__ import (absolute_import, division, print_function, unicode_literals)
 
+import atexit
+import threading
 import multiprocessing as mp
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import os
 
-from sync_app.util import get_md5, get_sha1
+from sync_app.util import get_hashes, get_hashes_batch, get_fingerprint, HASH_TYPES
 
 from sync_app.file_info import FileInfo, StatTuple
 
-_pool = ProcessPoolExecutor(max_workers=mp.cpu_count())
+HASH_POOL_TYPE = os.getenv('SYNC_APP_HASH_POOL', 'process')
+HASH_POOL_WORKERS = int(os.getenv('SYNC_APP_HASH_WORKERS', '0')) or mp.cpu_count()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+SMALL_FILE_SIZE = 1024 * 1024
+BATCH_MAX_FILES = 256
+BATCH_MAX_BYTES = 64 * 1024 * 1024
+HDD_WORKERS = 1
+SSD_WORKERS = HASH_POOL_WORKERS
+DEVICE_QUEUE_SIZE = 4096
+ROTATIONAL_PATHS = ('/sys/dev/block/%d:%d/queue/rotational',
+                    '/sys/dev/block/%d:%d/../queue/rotational')
+
+
+def make_pool(pool_type=None, max_workers=None):
+    """
+        new hashing pool, pool_type is 'process' or 'thread'
+        (hashlib releases the GIL, threads suffice when hashing is I/O bound),
+        defaults come from $SYNC_APP_HASH_POOL and $SYNC_APP_HASH_WORKERS
+    """
+    pool_type = pool_type or HASH_POOL_TYPE
+    if pool_type not in ('process', 'thread'):
+        raise ValueError('unknown pool type %s' % pool_type)
+    executor = ThreadPoolExecutor if pool_type == 'thread' else ProcessPoolExecutor
+    return executor(max_workers=max_workers or HASH_POOL_WORKERS)
+
+
+def get_pool():
+    """
+        hashing pool, created on first use,
+        HashScheduler gets it on the submitting thread before any dispatch thread starts
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = make_pool()
+            # worker processes are started by the first submit, do it on this thread
+            _pool.submit(os.getpid).result()
+        return _pool
+
+
+def set_pool(pool_type=None, max_workers=None):
+    """ replace the hashing pool, see make_pool, the old one is shut down """
+    global _pool
+    pool = make_pool(pool_type, max_workers)
+    with _pool_lock:
+        old_pool, _pool = _pool, pool
+    if old_pool is not None:
+        old_pool.shutdown()
+    return pool
+
+
+def shutdown_pool():
+    """ wait for and remove the hashing pool, a later get_pool creates a new one """
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
+
+
+atexit.register(shutdown_pool)
+
+
+def is_rotational(st_dev):
+    """ True for spinning disks, False for ssd/nvme, None if sysfs doesn't tell """
+    for path in ROTATIONAL_PATHS:
+        path = path % (os.major(st_dev), os.minor(st_dev))
+        try:
+            with open(path) as infile:
+                return infile.read().strip() == '1'
+        except (IOError, OSError):
+            continue
+    return None
+
+
+class HashBatch(object):
+    """ list of files of one device hashed by a single pool task """
+
+    def __init__(self, hash_types=HASH_TYPES):
+        self.hash_types = tuple(hash_types)
+        self.fnames = []
+        self.jobs = []
+        self.nbytes = 0
+        self.future = None
+
+    def add(self, fname, size, job):
+        """ add file of job to batch """
+        job.batch = self
+        job.index = len(self.fnames)
+        self.fnames.append(fname)
+        self.jobs.append(job)
+        self.nbytes += size
+
+    def is_full(self):
+        return len(self.fnames) >= BATCH_MAX_FILES or self.nbytes >= BATCH_MAX_BYTES
+
+    def run(self, pool):
+        """ hash the batch in pool, runs in the dispatch thread of the device """
+        return pool.submit(get_hashes_batch, self.fnames, self.hash_types).result()
+
+
+class HashJob(object):
+    """ one queued file, batch and index are assigned once its device queue is dispatched """
+    __slots__ = ('scheduler', 'key', 'batch', 'index')
+
+    def __init__(self, scheduler, key):
+        self.scheduler = scheduler
+        self.key = key
+        self.batch = None
+        self.index = None
+
+
+class HashResult(object):
+    """ future-like view of one digest of one queued file """
+    __slots__ = ('job', 'position')
+
+    def __init__(self, job, position):
+        self.job = job
+        self.position = position
+
+    def result(self):
+        if self.job.batch is None:
+            self.job.scheduler.flush()
+        return self.job.batch.future.result()[self.job.index][self.position]
+
+
+class HashScheduler(object):
+    """
+        queue hashing per block device, a device's files are read in inode order
+        by at most HDD_WORKERS (spinning) or SSD_WORKERS pool tasks at a time,
+        different devices are hashed in parallel
+    """
+
+    def __init__(self, hdd_workers=HDD_WORKERS, ssd_workers=SSD_WORKERS,
+                 queue_size=DEVICE_QUEUE_SIZE):
+        self.hdd_workers = hdd_workers
+        self.ssd_workers = ssd_workers
+        self.queue_size = queue_size
+        self.device_workers = {}
+        self.pending = {}
+        # (st_dev, st_ino, size, mtime) -> HashResults of queued and running jobs
+        self.submitted = {}
+        self.lock = threading.Lock()
+        self.dispatchers = {}
+
+    def get_workers(self, st_dev):
+        """ parallelism of device, detected once unless set in device_workers """
+        if st_dev not in self.device_workers:
+            rotational = is_rotational(st_dev) if st_dev is not None else None
+            self.device_workers[st_dev] = self.hdd_workers if rotational else self.ssd_workers
+        return self.device_workers[st_dev]
+
+    def submit(self,
+               fname,
+               hash_types=HASH_TYPES,
+               size=None,
+               st_dev=None,
+               st_ino=None,
+               st_mtime=None):
+        """
+            queue fname on its device, return dict of HashResult objects keyed by hash type,
+            paths sharing (st_dev, st_ino, size, mtime) (hardlinks) share one read
+        """
+        hash_types = tuple(hash_types)
+        if None in (size, st_dev, st_ino, st_mtime):
+            fstat = os.stat(fname)
+            size, st_dev, st_ino, st_mtime = \
+                fstat.st_size, fstat.st_dev, fstat.st_ino, fstat.st_mtime
+        key = (st_dev, st_ino, size, int(st_mtime))
+        with self.lock:
+            results = self.submitted.setdefault(key, {})
+            missing = tuple(htype for htype in hash_types if htype not in results)
+            if missing:
+                job = HashJob(self, key)
+                results.update({htype: HashResult(job, pos) for pos, htype in enumerate(missing)})
+            output = {htype: results[htype] for htype in hash_types}
+        if missing:
+            queue = self.pending.setdefault(st_dev, [])
+            queue.append((st_ino, fname, size, missing, job))
+            if len(queue) >= self.queue_size:
+                self.flush(st_dev)
+        return output
+
+    def release(self, batch):
+        """ forget the jobs of a finished batch, their HashResults hold the digests """
+        with self.lock:
+            for job in batch.jobs:
+                results = self.submitted.get(job.key, {})
+                for htype in [htype for htype, res in results.items() if res.job is job]:
+                    results.pop(htype)
+                if not results:
+                    self.submitted.pop(job.key, None)
+
+    def flush(self, st_dev=None):
+        """
+            dispatch the queue of st_dev (default every device) sorted by inode,
+            small files share one pool task, large files get their own
+        """
+        devices = list(self.pending) if st_dev is None else [st_dev]
+        for dev in devices:
+            batches = {}
+            for _, fname, size, hash_types, job in sorted(
+                    self.pending.pop(dev, []), key=lambda x: x[:2]):
+                if size >= SMALL_FILE_SIZE:
+                    for key in list(batches):
+                        self.dispatch(dev, batches.pop(key))
+                    batch = HashBatch(hash_types)
+                    batch.add(fname, size, job)
+                    self.dispatch(dev, batch)
+                    continue
+                batch = batches.get(hash_types)
+                if batch is None:
+                    batch = batches[hash_types] = HashBatch(hash_types)
+                batch.add(fname, size, job)
+                if batch.is_full():
+                    self.dispatch(dev, batches.pop(hash_types))
+            for batch in batches.values():
+                self.dispatch(dev, batch)
+
+    def dispatch(self, st_dev, batch):
+        """
+            run batch through the (FIFO) dispatch threads of st_dev,
+            the pool is created here, not in a dispatch thread
+        """
+        pool = get_pool()
+        if st_dev not in self.dispatchers:
+            self.dispatchers[st_dev] = ThreadPoolExecutor(max_workers=self.get_workers(st_dev))
+        batch.future = self.dispatchers[st_dev].submit(batch.run, pool)
+        batch.future.add_done_callback(lambda _: self.release(batch))
+        return batch.future
+
+    def shutdown(self):
+        """ wait for and remove the dispatch threads, later batches start new ones """
+        dispatchers, self.dispatchers = self.dispatchers, {}
+        for dispatcher in dispatchers.values():
+            dispatcher.shutdown()
+
+
+_scheduler = HashScheduler()
+# registered after shutdown_pool, so it runs first, while the pool still exists
+atexit.register(_scheduler.shutdown)
+
+
+def submit_hashes(fname, size=None, hash_types=HASH_TYPES, st_dev=None, st_ino=None,
+                  st_mtime=None):
+    """ queue fname for hashing, return dict of HashResult objects keyed by hash type """
+    return _scheduler.submit(
+        fname, hash_types=hash_types, size=size, st_dev=st_dev, st_ino=st_ino, st_mtime=st_mtime)
+
+
+def flush_hashes():
+    """ dispatch every queued file """
+    _scheduler.flush()
 
 
 class FileInfoLocal(FileInfo):
     """ File Info Local """
 
-    def __init__(self, fn='', md5='', sha1='', fs=None, in_tuple=None):
-        """ Init function """
+    def __init__(self, fn='', md5='', sha1='', fs=None, in_tuple=None, hash_types=HASH_TYPES):
+        """
+            Init function, digests are computed lazily,
+            hash_types are the digests computed together once any digest is needed
+        """
         absfn = ''
         _url = ''
         if fn:
             absfn = os.path.abspath(fn)
-            if not os.path.isfile(absfn):
+            # a given fs means the caller already found a regular file there
+            if fs is None and not os.path.isfile(absfn):
                 print('ERROR')
                 raise TypeError
             _url = 'file://%s' % absfn
+        self.hash_types = tuple(hash_types)
+        self._hash_results = {}
+        self.fingerprint = ''
+        self.st_dev = int(getattr(fs, 'st_dev', 0) or 0)
+        self.st_ino = int(getattr(fs, 'st_ino', 0) or 0)
         FileInfo.__init__(self, fn=absfn, url=_url, md5=md5, sha1=sha1, fs=fs, in_tuple=in_tuple)
 
+    def has_digest(self, htype):
+        """ is digest already known or queued """
+        if htype in self._hash_results:
+            return True
+        return bool(getattr(self, '%ssum' % htype, '')) if htype in ('md5', 'sha1') else False
+
+    def submit_hashes(self, hash_types=()):
+        """
+            queue every missing digest in hash_types and self.hash_types
+            as a single read, return True if anything was queued
+        """
+        hash_types = self.hash_types + tuple(x for x in hash_types if x not in self.hash_types)
+        missing = tuple(htype for htype in hash_types if not self.has_digest(htype))
+        if not missing:
+            return False
+        try:
+            fstat = os.stat(self.filename)
+        except OSError:
+            return False
+        self._hash_results.update(
+            submit_hashes(
+                self.filename,
+                size=fstat.st_size,
+                hash_types=missing,
+                st_dev=fstat.st_dev,
+                st_ino=fstat.st_ino,
+                st_mtime=fstat.st_mtime))
+        for htype in ('md5', 'sha1'):
+            if htype in missing:
+                setattr(self, '%ssum' % htype, self._hash_results[htype])
+        return True
+
     def get_md5(self):
-        """ Wrapper around sync_utils.get_md5 """
-        if os.path.exists(self.filename):
-            return _pool.submit(get_md5, self.filename)
-        else:
-            return self.md5sum
+        """ Wrapper around submit_hashes """
+        self.submit_hashes(('md5', ))
+        return self.md5sum
 
     def get_sha1(self):
-        """ Wrapper around sync_utils.get_sha1 """
-        if os.path.exists(self.filename):
-            return _pool.submit(get_sha1, self.filename)
-        else:
-            return self.sha1sum
+        """ Wrapper around submit_hashes """
+        self.submit_hashes(('sha1', ))
+        return self.sha1sum
+
+    def get_digests(self, hash_types=HASH_TYPES):
+        """ compute every missing digest in hash_types with a single read """
+        self.submit_hashes(hash_types)
+        output = FileInfo.get_digests(self, hash_types)
+        for htype, digest in output.items():
+            if not digest and htype in self._hash_results:
+                output[htype] = self._hash_results[htype].result()
+        return output
+
+    def get_fingerprint(self):
+        """ lazily computed head/tail fingerprint, see sync_app.util.get_fingerprint """
+        if not self.fingerprint and os.path.exists(self.filename):
+            self.fingerprint = get_fingerprint(self.filename)
+        return self.fingerprint
+
+    def get_inode_key(self):
+        """ (st_dev, st_ino, st_size, st_mtime), shared by hardlinks, None if unknown """
+        if not self.st_ino:
+            return None
+        return (self.st_dev, self.st_ino, self.filestat.st_size, self.filestat.st_mtime)
+
+    def copy_digests(self, other):
+        """ take the known digests and fingerprint of other, e.g. a hardlink of this file """
+        for attr in ('md5sum', 'sha1sum', 'fingerprint'):
+            val = getattr(other, attr, '')
+            if val and not hasattr(val, 'result') and not getattr(self, attr):
+                setattr(self, attr, val)
+
+    def output_cache_tuple(self):
+        """ serialize FileInfoLocal, fingerprint and inode are stored next to md5/sha1 """
+        return FileInfo.output_cache_tuple(self) + (self.fingerprint, self.st_dev, self.st_ino)
+
+    def input_cache_tuple(self, in_tuple):
+        """ deserialize FileInfoLocal, accept entries without fingerprint or inode """
+        FileInfo.input_cache_tuple(self, in_tuple[:6])
+        self.fingerprint = in_tuple[6] if len(in_tuple) > 6 else ''
+        if len(in_tuple) > 8:
+            self.st_dev, self.st_ino = (int(x or 0) for x in in_tuple[7:9])
 
     def get_stat(self):
         """ Wrapper around os.stat """
         if os.path.exists(self.filename):
-            self.filestat = StatTuple(os.stat(self.filename))
-        return self.filestat
+            fstat = os.stat(self.filename)
+            self.filestat = StatTuple(fstat)
+            self.st_dev, self.st_ino = fstat.st_dev, fstat.st_ino
+        return getattr(self, 'filestat', None)
 
 
 def test_file_info_local():
@@ -81,3 +416,92 @@ def test_file_info_local():
     print(tmp)
     print(test)
     assert tmp == test
+
+
+def test_submit_hashes():
+    """ Test submit_hashes """
+    fn0 = 'tests/test_dir/hello_world.txt'
+    fn1 = 'tests/test_dir/goodbye_world.txt'
+    tmp0 = submit_hashes(fn0)
+    tmp1 = submit_hashes(fn1)
+    md0, sha0, md1 = tmp0['md5'], tmp0['sha1'], tmp1['md5']
+    assert md0.job.batch is None
+    flush_hashes()
+    assert md0.job.batch is md1.job.batch
+    assert md0.result() == '8ddd8be4b179a529afa5f2ffae4b9858'
+    assert sha0.result() == 'a0b65939670bc2c010f4d5d6a0b3e4e4590fb92b'
+    assert md1.result() == '6cc33a6b873364031596bd67af5022cb'
+
+
+def test_hash_scheduler():
+    """ Test HashScheduler orders a device queue by inode """
+    fnames = [
+        'tests/test_dir/hello_world.txt', 'tests/test_dir/goodbye_world.txt',
+        'tests/test_dir/test_subdir/whats_happening.txt'
+    ]
+    assert is_rotational(os.stat(fnames[0]).st_dev) in (True, False, None)
+    scheduler = HashScheduler(queue_size=2)
+    results = [scheduler.submit(fn_, hash_types=('md5', )) for fn_ in fnames]
+    batch = results[0]['md5'].job.batch
+    assert batch is results[1]['md5'].job.batch
+    assert batch.fnames == sorted(fnames[:2], key=lambda x: os.stat(x).st_ino)
+    assert results[2]['md5'].job.batch is None
+    assert results[2]['md5'].result() == get_hashes(fnames[2], hash_types=('md5', ))[0]
+    assert results[0]['md5'].result() == '8ddd8be4b179a529afa5f2ffae4b9858'
+
+    # the same file is queued once while pending, forgotten once hashed
+    scheduler = HashScheduler()
+    results = [scheduler.submit(fnames[0], hash_types=('md5', )) for _ in range(2)]
+    assert results[0]['md5'] is results[1]['md5']
+    assert len(scheduler.submitted) == 1
+    assert results[0]['md5'].result() == '8ddd8be4b179a529afa5f2ffae4b9858'
+    scheduler.shutdown()
+    assert scheduler.submitted == {} and scheduler.dispatchers == {}
+
+
+def test_set_pool():
+    """ Test replacing the hashing pool """
+    pool = set_pool('thread', max_workers=2)
+    assert isinstance(pool, ThreadPoolExecutor)
+    assert get_pool() is pool
+    fn_ = 'tests/test_dir/hello_world.txt'
+    assert submit_hashes(fn_)['md5'].result() == '8ddd8be4b179a529afa5f2ffae4b9858'
+    shutdown_pool()
+    assert _pool is None
+    pools = []
+    threads = [threading.Thread(target=lambda: pools.append(get_pool())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(pools) == 8 and all(pool is pools[0] for pool in pools)
+    assert isinstance(pools[0],
+                      ThreadPoolExecutor if HASH_POOL_TYPE == 'thread' else ProcessPoolExecutor)
+
+
+def test_get_digests():
+    """ Test FileInfoLocal.get_digests """
+    fn_ = 'tests/test_dir/hello_world.txt'
+    tmp = FileInfoLocal(fn=fn_, hash_types=('md5', ))
+    assert tmp.md5sum == ''
+    assert tmp.get_md5().result() == '8ddd8be4b179a529afa5f2ffae4b9858'
+    assert tmp.sha1sum == ''
+    output = tmp.get_digests(('sha1', 'sha256'))
+    assert output['sha1'] == 'a0b65939670bc2c010f4d5d6a0b3e4e4590fb92b'
+    assert output['sha256'] == get_hashes(fn_, hash_types=('sha256', ))[0]
+    assert tmp.sha1sum == 'a0b65939670bc2c010f4d5d6a0b3e4e4590fb92b'
+
+
+def test_fingerprint_cache_tuple():
+    """ Test FileInfoLocal fingerprint and inode serialization """
+    fn_ = 'tests/test_dir/hello_world.txt'
+    tmp = FileInfoLocal(fn=fn_)
+    fprint = tmp.get_fingerprint()
+    assert fprint == get_fingerprint(fn_)
+    tmp = FileInfoLocal(in_tuple=tmp.output_cache_tuple())
+    assert tmp.fingerprint == fprint
+    st_ = os.stat(fn_)
+    assert tmp.get_inode_key() == (st_.st_dev, st_.st_ino, st_.st_size, int(st_.st_mtime))
+    tmp = FileInfoLocal(in_tuple=tmp.output_cache_tuple()[:6])
+    assert tmp.fingerprint == ''
+    assert tmp.get_inode_key() is None
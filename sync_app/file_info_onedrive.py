@@ -12,7 +12,7 @@ from sync_app.file_info import FileInfo
 
 BASE_DIR = '%s/OneDrive' % os.getenv('HOME')
 
-FILE_INFO_SLOTS = ('onedriveid', 'mimetype', 'exportpath', 'onedrive', 'sha1sum', 'parentid')
+FILE_INFO_SLOTS = ('onedriveid', 'mimetype', 'exportpath', 'onedrive', 'parentid')
 
 
 class FileInfoOneDrive(FileInfo):
@@ -65,7 +65,7 @@ class FileInfoOneDrive(FileInfo):
                'id=%s)>' % self.onedriveid
 
     def output_cache_tuple(self):
-        return (self.filename, self.urlname, self.sha1sum, self.filestat.st_mtime,
+        return (self.filename, self.urlname, self.sha1_digest, self.filestat.st_mtime,
                 self.filestat.st_size, self.onedriveid, self.mimetype, self.exportpath,
                 self.onedrive)
 
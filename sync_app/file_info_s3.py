@@ -32,7 +32,7 @@ class FileInfoS3(FileInfo):
         self.fill_stat(**_temp)
 
     def output_cache_tuple(self):
-        return (self.filename, self.urlname, self.md5sum, self.filestat.st_mtime,
+        return (self.filename, self.urlname, self.md5_digest, self.filestat.st_mtime,
                 self.filestat.st_size, self.bucket)
 
     def input_cache_tuple(self, in_tuple):
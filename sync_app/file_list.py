@@ -5,15 +5,102 @@
     FileList:
         container for list of FileInfo object
         dicts to efficiently search within filelist
+    FileNameDict:
+        path keyed dict stored by directory, answers subtree queries
 """
 from __future__ import (absolute_import, division, print_function, unicode_literals)
 
 import os
+from bisect import bisect_left
 from collections import defaultdict
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+from sync_app.util import to_digest, split_path, intern_directory
 
 FILE_LIST_TYPES = ('local', 'remote', 'gdrive', 's3', 'onedrive', 'box')
 
 
+class FileNameDict(MutableMapping):
+    """
+        dict keyed by path, stored as interned directory -> {basename: value},
+        so a directory prefix is kept once instead of once per path
+    """
+
+    def __init__(self):
+        self.directories = {}
+        # sorted directory names, rebuilt on the first get_under after a directory is added
+        self.directory_list = None
+        self.length = 0
+
+    def __getitem__(self, key):
+        dname, fname = split_path(key)
+        entries = self.directories.get(dname)
+        if entries is None or fname not in entries:
+            raise KeyError(key)
+        return entries[fname]
+
+    def __setitem__(self, key, value):
+        dname, fname = split_path(key)
+        self.add(dname, fname, value)
+
+    def add(self, dname, fname, value):
+        """ set value of path dname + fname, for callers which already hold the parts """
+        entries = self.directories.get(dname)
+        if entries is None:
+            entries = self.directories[intern_directory(dname)] = {}
+            self.directory_list = None
+        if fname not in entries:
+            self.length += 1
+        entries[fname] = value
+
+    def __delitem__(self, key):
+        dname, fname = split_path(key)
+        entries = self.directories.get(dname)
+        if entries is None or fname not in entries:
+            raise KeyError(key)
+        del entries[fname]
+        self.length -= 1
+        if not entries:
+            del self.directories[dname]
+            self.directory_list = None
+
+    def __contains__(self, key):
+        dname, fname = split_path(key)
+        return fname in self.directories.get(dname, ())
+
+    def __iter__(self):
+        for dname, entries in self.directories.items():
+            for fname in entries:
+                yield dname + fname
+
+    def __len__(self):
+        return self.length
+
+    def values(self):
+        return [value for entries in self.directories.values() for value in entries.values()]
+
+    def items(self):
+        return [(dname + fname, value) for dname, entries in self.directories.items()
+                for fname, value in entries.items()]
+
+    def get_under(self, directory):
+        """ values in directory or any directory below it """
+        prefix = '%s/' % directory.rstrip('/')
+        if self.directory_list is None:
+            self.directory_list = sorted(self.directories)
+        output = []
+        # directory names starting with prefix are adjacent in sorted order
+        for idx in range(bisect_left(self.directory_list, prefix), len(self.directory_list)):
+            dname = self.directory_list[idx]
+            if not dname.startswith(prefix):
+                break
+            output.extend(self.directories[dname].values())
+        return output
+
+
 class FileList(object):
     """ file list class """
 
@@ -22,6 +109,8 @@ class FileList(object):
         self.filelist_name_dict = defaultdict(list)
         self.filelist_md5_dict = defaultdict(list)
         self.filelist_sha1_dict = defaultdict(list)
+        self.filelist_size_dict = defaultdict(list)
+        self.filelist_relpath_dict = FileNameDict()
         self.filelist_type = filelist_type if filelist_type else 'local'
 
         self.basedir = basedir if basedir else os.getenv('HOME')
@@ -36,7 +125,7 @@ class FileList(object):
     @filelist.setter
     def filelist(self, val):
         """ make a copy of list, element by element """
-        self.__filelist = {}
+        self.__filelist = FileNameDict()
         for k__, v__ in val.items():
             if k__ not in self.__filelist:
                 self.__filelist[k__] = v__
@@ -55,16 +144,24 @@ class FileList(object):
             raise ValueError
 
     def __getitem__(self, key):
-        """ try to simplify calling a bit... """
-        if key in self.filelist_md5_dict:
-            return self.filelist_md5_dict.__getitem__(key)
-        elif key in self.filelist_sha1_dict:
-            return self.filelist_sha1_dict.__getitem__(key)
+        """ try to simplify calling a bit..., hash dicts are keyed by raw digests """
+        digest = to_digest(key)
+        if digest in self.filelist_md5_dict:
+            return self.filelist_md5_dict.__getitem__(digest)
+        elif digest in self.filelist_sha1_dict:
+            return self.filelist_sha1_dict.__getitem__(digest)
         elif key in self.filelist_name_dict:
             return self.filelist_name_dict.__getitem__(key)
         else:
             return self.filelist.__getitem__(key)
 
+    def get_relpath(self, filename):
+        """ filename relative to basedir, filenames outside of basedir are kept as they are """
+        prefix = '%s/' % self.basedir.rstrip('/') if self.basedir else None
+        if prefix and filename.startswith(prefix):
+            return filename[len(prefix):]
+        return filename
+
     def __iter__(self):
         if hasattr(self.filelist, 'itervalues'):
             return self.filelist.itervalues()
@@ -76,13 +173,44 @@ class FileList(object):
         if not all(
                 hasattr(file_info_obj, at) for at in ('filename', 'urlname', 'md5sum', 'filestat')):
             raise ValueError('this object won\'t work')
+        self._append(file_info_obj)
+
+    def _append(self, file_info_obj):
+        """ append without validating file_info_obj, for subclasses creating the objects """
         ffn_ = file_info_obj.filename
+        dname, fn_ = split_path(ffn_)
+        if hasattr(file_info_obj, 'basename'):
+            # one basename string for the object and every dict
+            fn_ = file_info_obj.basename
+        reldname = split_path(self.get_relpath(ffn_))[0]
         if ffn_ in self.filelist:
-            self.filelist[ffn_] = file_info_obj
+            old_obj = self.filelist[ffn_]
+            size_list = self.filelist_size_dict[old_obj.filestat.st_size]
+            if old_obj in size_list:
+                size_list.remove(old_obj)
+            self.filelist.add(dname, fn_, file_info_obj)
+            self.filelist_relpath_dict.add(reldname, fn_, file_info_obj)
+            self.filelist_size_dict[file_info_obj.filestat.st_size].append(file_info_obj)
             return
-        fn_ = os.path.basename(ffn_)
-        self.filelist[ffn_] = file_info_obj
+        self.filelist.add(dname, fn_, file_info_obj)
         self.filelist_name_dict[fn_].append(file_info_obj)
+        self.filelist_relpath_dict.add(reldname, fn_, file_info_obj)
+        self.filelist_size_dict[file_info_obj.filestat.st_size].append(file_info_obj)
+
+    def get_files_under(self, directory):
+        """ entries in directory or any directory below it """
+        return self.filelist.get_under(directory)
+
+    def get_size_candidates(self, size):
+        """ entries which could match a file of given size by content """
+        return self.filelist_size_dict.get(size, [])
+
+    def get_duplicate_candidates(self):
+        """ groups of entries sharing a (known) size, the only possible duplicates """
+        return {
+            size: entries
+            for size, entries in self.filelist_size_dict.items() if size and len(entries) > 1
+        }
 
     def fill_hash_dicts(self):
         for key in self.filelist:
@@ -91,8 +219,8 @@ class FileList(object):
                 finfo.md5sum = finfo.md5sum.result()
             if hasattr(finfo.sha1sum, 'result'):
                 finfo.sha1sum = finfo.sha1sum.result()
-            md5 = finfo.md5sum
-            sha1 = finfo.sha1sum
+            md5 = finfo.md5_digest
+            sha1 = finfo.sha1_digest
             if md5:
                 self.filelist_md5_dict[md5].append(finfo)
             if sha1:
@@ -130,6 +258,62 @@ def test_file_list():
     test_tmp1()
 
 
+def test_file_list_size_dict():
+    """ test FileList.filelist_size_dict """
+    from sync_app.file_info import FileInfo, StatTuple
+    tmp0 = FileList()
+    for idx, size in enumerate((10, 20, 20, 30)):
+        tmp0.append(FileInfo(fn='/tmp/file%d' % idx, fs=StatTuple(st_size=size)))
+    tmp0.append(FileInfo(fn='/tmp/file0', fs=StatTuple(st_size=40)))
+    assert tmp0.filelist_size_dict[10] == []
+    assert [x.filename for x in tmp0.get_size_candidates(40)] == ['/tmp/file0']
+    assert list(tmp0.get_duplicate_candidates()) == [20]
+
+
+def test_file_list_files_under():
+    """ test FileList.get_files_under """
+    from sync_app.file_info import FileInfo, StatTuple
+    tmp = FileList()
+    for fn_ in ('/a/b/x.txt', '/a/b/c/y.txt', '/a/bc/z.txt', 'a/b/w.txt'):
+        tmp.append(FileInfo(fn=fn_, fs=StatTuple(st_size=1)))
+    tmp.append(FileInfo(fn='/a/b/x.txt', fs=StatTuple(st_size=2)))
+    assert sorted(x.filename for x in tmp.get_files_under('/a/b/')) == \
+        ['/a/b/c/y.txt', '/a/b/x.txt']
+    assert [x.filestat.st_size for x in tmp.get_files_under('/a/b/x.txt')] == []
+    assert [x.filename for x in tmp.get_files_under('a')] == ['a/b/w.txt']
+    assert len(tmp.get_files_under('/')) == 3
+    assert tmp.get_files_under('/d') == []
+    assert sorted(tmp.filelist.directories) == ['/a/b/', '/a/b/c/', '/a/bc/', 'a/b/']
+
+
+def test_file_name_dict():
+    """ test FileNameDict """
+    tmp = FileNameDict()
+    for idx, fn_ in enumerate(('/a/b/x.txt', '/a/b/c/y.txt', '/a/bc/z.txt', 'w.txt')):
+        tmp[fn_] = idx
+    tmp['/a/b/x.txt'] = 4
+    assert len(tmp) == 4 and sorted(tmp.values()) == [1, 2, 3, 4]
+    assert '/a/b/x.txt' in tmp and '/a/b/y.txt' not in tmp and '/a/b' not in tmp
+    assert tmp.get('/a/b/c/y.txt') == 1 and tmp.get('/a/b/c') is None
+    assert sorted(tmp.get_under('/a/b')) == [1, 4]
+    del tmp['/a/b/c/y.txt']
+    assert sorted(tmp) == ['/a/b/x.txt', '/a/bc/z.txt', 'w.txt']
+    assert tmp.get_under('/a/b/c') == [] and sorted(tmp.get_under('/a')) == [2, 4]
+    assert sorted(tmp.directories) == ['', '/a/b/', '/a/bc/']
+
+
+def test_file_list_relpath_dict():
+    """ test FileList.filelist_relpath_dict """
+    from sync_app.file_info import FileInfo, StatTuple
+    tmp = FileList(basedir='/a/')
+    for fn_ in ('/a/b/x.txt', '/a/c/x.txt', '/ab/x.txt', 'b/y.txt'):
+        tmp.append(FileInfo(fn=fn_, fs=StatTuple(st_size=1)))
+    tmp.append(FileInfo(fn='/a/b/x.txt', fs=StatTuple(st_size=2)))
+    assert sorted(tmp.filelist_relpath_dict) == ['/ab/x.txt', 'b/x.txt', 'b/y.txt', 'c/x.txt']
+    assert tmp.filelist_relpath_dict['b/x.txt'].filestat.st_size == 2
+    assert len(tmp.filelist_name_dict['x.txt']) == 3
+
+
 def test_file_list_add():
     tmp = FileList()
     new_filelist = {'key0': 'val0', 'key1': 'val1'}
@@ -9,19 +9,29 @@ import os
 from collections import defaultdict
 
 from sync_app.file_list import FileList
+from sync_app.file_list_remote import FileListRemote
+from sync_app.folder_tree import FolderTree
 from sync_app.file_info_box import (FileInfoBox, BASE_DIR)
 
 
-class FileListBox(FileList):
+class FileListBox(FileListRemote):
     """ Box File List """
+    file_info_class = FileInfoBox
+    instance_attr = 'box'
 
     def __init__(self, filelist=None, basedir=None, box=None):
         """ Init Function """
-        FileList.__init__(self, filelist=filelist, basedir=basedir, filelist_type='box')
+        FileList.__init__(
+            self,
+            filelist=filelist,
+            basedir=basedir if basedir else BASE_DIR,
+            filelist_type='box')
         self.filelist_id_dict = {}
         self.directory_id_dict = {}
         self.directory_name_dict = defaultdict(dict)
+        self.item_versions = {}
         self.box = box
+        self.folder_tree = FolderTree(root_ids=['0'])
 
     def __getitem__(self, key):
         for dict_ in (self.filelist_id_dict, self.directory_id_dict, self.directory_name_dict):
@@ -37,6 +47,7 @@ class FileListBox(FileList):
     def append_item(self, item):
         """ append file to FileList, fill dict's """
         finfo = FileInfoBox(box=self.box, item=item)
+        self.add_version(item)
 
         ### Fix paths
         finfo.exportpath = self.get_export_path(finfo, abspath=False)
@@ -62,38 +73,22 @@ class FileListBox(FileList):
         finfo = FileInfoBox(box=self.box, item=item)
         if item.get('type', '') != 'folder':
             return finfo
+        self.add_version(item)
+        return self.add_dir(finfo)
 
+    def add_dir(self, finfo):
+        """ add directory FileInfoBox """
+        self.folder_tree.add(finfo.boxid, os.path.basename(finfo.filename), finfo.parentid)
         self.filelist_id_dict[finfo.boxid] = finfo
         self.directory_id_dict[finfo.boxid] = finfo
         self.directory_name_dict[finfo.filename][finfo.parentid] = finfo
-
-    def get_parent_directories(self, finfo):
-        pid = finfo.parentid
-        while pid is not None:
-            newfinfo = self.filelist_id_dict.get(pid, None)
-            if newfinfo is None:
-                newfinfo = self.box.client.folder(folder_id=pid).get()
-                finfo = self.append_dir(newfinfo)
-                pid = finfo.parentid
-            else:
-                finfo = newfinfo
-                pid = finfo.parentid
         return finfo
 
     def get_export_path(self, finfo, abspath=True, is_dir=False):
         """ determine export path for given finfo object"""
-        fullpath = []
+        fullpath = self.folder_tree.get_path(finfo.parentid)
         if is_dir:
-            fullpath.append(finfo.filename)
-        pid = finfo.parentid
-        while pid != '0':
-            if pid in self.filelist_id_dict:
-                finf = self.filelist_id_dict[pid]
-                pid = finf.parentid
-                fullpath.append(os.path.basename(finf.filename))
-            else:
-                raise ValueError('no parent %s' % pid)
-        fullpath = '/'.join(fullpath[::-1])
+            fullpath = '%s/%s' % (fullpath, finfo.filename) if fullpath else finfo.filename
         if not fullpath:
             fullpath = 'Box'
         elif 'Box' not in fullpath:
@@ -110,23 +105,6 @@ class FileListBox(FileList):
         for _, finfo in self.directory_id_dict.items():
             finfo.exportpath = self.get_export_path(finfo, is_dir=True)
 
-    def fill_file_list(self, number_to_process=-1, searchstr=None, verbose=True):
-        """ fill Box file list"""
-        if not self.box:
-            raise Exception('what happened?')
-        if verbose:
-            print('get_folders')
-        self.box.number_to_process = -1
-        self.box.get_folders(self.append_dir)
-        if verbose:
-            print('list_files')
-        self.box.number_to_process = number_to_process
-        self.box.items_processed = 0
-        self.box.list_files(self.append_item)
-        self.fill_hash_dicts()
-        if verbose:
-            print('update paths')
-
     def get_or_create_directory(self, dname):
         """ create directory on box """
         pid_ = '0'
@@ -6,11 +6,13 @@
 from __future__ import (absolute_import, division, print_function, unicode_literals)
 
 import os
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from apiclient.errors import HttpError
 
 from sync_app.file_list import FileList
-from sync_app.gdrive_instance import GdriveInstance, TExecuteException
+from sync_app.file_cache import FileListCache
+from sync_app.folder_tree import FolderTree
+from sync_app.gdrive_instance import GdriveInstance, TExecuteException, InvalidPageToken
 from sync_app.file_info_gdrive import BASE_DIR, FileInfoGdrive
 
 
@@ -19,12 +21,22 @@ class FileListGdrive(FileList):
 
     def __init__(self, filelist=None, basedir=None, gdrive=None):
         """ Init Function """
-        FileList.__init__(self, filelist=filelist, basedir=basedir, filelist_type='gdrive')
+        FileList.__init__(
+            self,
+            filelist=filelist,
+            basedir=basedir if basedir else BASE_DIR,
+            filelist_type='gdrive')
         self.filelist_id_dict = {}
         self.directory_id_dict = {}
         self.directory_name_dict = defaultdict(list)
         self.gdrive = gdrive
         self.root_directory = None
+        # raw items in the order they were added, parents come before their children
+        self.item_dict = OrderedDict()
+        self.folder_tree = FolderTree(fetch_fn=self.fetch_folder)
+        # items whose path couldn't be resolved and folders which couldn't be fetched
+        self.nskipped = 0
+        self.missing_folders = set()
 
     def __getitem__(self, key):
         for dict_ in (self.filelist_id_dict, self.directory_id_dict, self.directory_name_dict):
@@ -42,11 +54,15 @@ class FileListGdrive(FileList):
         if item['mimeType'] == 'application/vnd.google-apps.folder':
             return self.append_dir(item)
         finfo = FileInfoGdrive(gdrive=self.gdrive, item=item)
+        # kept even if the path can't be resolved, resolution is retried on the next run
+        self.item_dict[finfo.gdriveid] = item
 
         ### Fix paths
         try:
             finfo.exportpath = self.get_export_path(finfo, abspath=False)
-        except TExecuteException:
+        except (TExecuteException, ValueError):
+            # orphaned, or a parent isn't shared with us
+            self.nskipped += 1
             return finfo
         if not finfo.urlname:
             finfo.urlname = 'gdrive://%s' % (finfo.exportpath)
@@ -80,48 +96,63 @@ class FileListGdrive(FileList):
         finfo = FileInfoGdrive(gdrive=self.gdrive, item=item)
         if item['mimeType'] != 'application/vnd.google-apps.folder':
             return finfo
+        self.item_dict[finfo.gdriveid] = item
+        return self.add_dir(finfo)
 
-        root_dir_ = self.get_parent_directories(finfo)
-        if not self.root_directory:
-            self.root_directory = root_dir_
-
+    def add_dir(self, finfo):
+        """ add directory FileInfoGdrive """
+        self.folder_tree.add(finfo.gdriveid, os.path.basename(finfo.filename), finfo.parentid)
         self.filelist_id_dict[finfo.gdriveid] = finfo
         self.directory_id_dict[finfo.gdriveid] = finfo
         self.directory_name_dict[finfo.filename].append(finfo)
+        if finfo.parentid is None and (not self.root_directory or
+                                       (finfo.filename == 'My Drive' and
+                                        self.root_directory.filename != 'My Drive')):
+            self.root_directory = finfo
         return finfo
 
-    def get_parent_directories(self, finfo):
-        pid = finfo.parentid
-        while pid is not None:
-            newfinfo = self.filelist_id_dict.get(pid, None)
-            if newfinfo is None:
-                response = self.gdrive.get_file(pid)
-                finfo = self.append_item(response)
-                pid = finfo.parentid
-            else:
-                finfo = newfinfo
-                pid = finfo.parentid
-        return finfo
+    def resolve_parents(self):
+        """
+            fetch the parents of directories which aren't known yet (e.g. the root folder isn't
+            part of a folder listing), in batch requests, until every ancestor is known
+        """
+        while True:
+            missing = set(
+                finfo.parentid for finfo in self.directory_id_dict.values()
+                if finfo.parentid and finfo.parentid not in self.filelist_id_dict)
+            missing -= self.missing_folders
+            if not missing:
+                return
+            items = self.gdrive.get_files(sorted(missing))
+            self.missing_folders.update(missing - set(item['id'] for item in items))
+            if not items:
+                return
+            for item in items:
+                self.append_dir(item)
+
+    def fetch_folder(self, fid):
+        """ get folder which isn't part of the list yet """
+        if fid in self.missing_folders:
+            return
+        if not self.gdrive:
+            self.gdrive = GdriveInstance()
+        try:
+            self.append_item(self.gdrive.get_file(fid))
+        except TExecuteException:
+            # the folder stays unknown, FolderTree.get_path raises ValueError
+            self.missing_folders.add(fid)
+
+    def report_skipped(self):
+        """ print the number of skipped items once, instead of a line per item """
+        if self.nskipped:
+            print('skipped %d items under %d folders which could not be fetched' %
+                  (self.nskipped, len(self.missing_folders)))
 
     def get_export_path(self, finfo, abspath=True, is_dir=False):
         """ determine export path for given finfo object"""
-        fullpath = []
+        fullpath = self.folder_tree.get_path(finfo.parentid)
         if is_dir:
-            fullpath.append(finfo.filename)
-        pid = finfo.parentid
-        while pid:
-            if pid in self.filelist_id_dict:
-                finf = self.filelist_id_dict[pid]
-                pid = finf.parentid
-                fullpath.append(os.path.basename(finf.filename))
-            else:
-                if not self.gdrive:
-                    self.gdrive = GdriveInstance()
-                response = self.gdrive.get_file(pid)
-                finf = self.append_item(response)
-                pid = finf.parentid
-                fullpath.append(os.path.basename(finf.filename))
-        fullpath = '/'.join(fullpath[::-1])
+            fullpath = '%s/%s' % (fullpath, finfo.filename) if fullpath else finfo.filename
         if not fullpath:
             fullpath = 'My Drive'
         elif 'My Drive' not in fullpath:
@@ -141,25 +172,108 @@ class FileListGdrive(FileList):
             finfo.exportpath = self.get_export_path(finfo, is_dir=True)
 
     def get_folders(self):
+        """ list every folder in one paged listing, then fetch missing ancestors in batches """
+        self.gdrive.number_to_process = -1
         self.gdrive.get_folders(self.append_dir)
-        finfo = iter(self.filelist_id_dict.values()).next()
-        self.root_directory = self.get_parent_directories(finfo)
+        self.resolve_parents()
 
-    def fill_file_list(self, number_to_process=-1, searchstr=None, verbose=True):
-        """ fill GDrive file list"""
+    def fill_file_list(self,
+                       number_to_process=-1,
+                       searchstr=None,
+                       verbose=True,
+                       index_file=None,
+                       rebuild_index=False):
+        """
+            fill GDrive file list,
+            with index_file only the changes since the last run are listed
+        """
         if not self.gdrive:
             self.gdrive = GdriveInstance()
-        if verbose:
-            print('get_folders')
-        self.gdrive.number_to_process = -1
-        if verbose:
-            print('list_files')
-        self.gdrive.number_to_process = number_to_process
-        self.gdrive.items_processed = 0
-        self.gdrive.list_files(self.append_item, searchstr=searchstr)
+        if index_file and not searchstr and number_to_process < 0:
+            self.fill_file_list_incremental(
+                index_file, rebuild_index=rebuild_index, verbose=verbose)
+        else:
+            if not searchstr:
+                if verbose:
+                    print('get_folders')
+                self.get_folders()
+            if verbose:
+                print('list_files')
+            self.gdrive.number_to_process = number_to_process
+            self.gdrive.items_processed = 0
+            self.gdrive.list_files(self.append_item, searchstr=searchstr)
+            self.fill_hash_dicts()
+            self.report_skipped()
+            if verbose:
+                print('update paths')
+
+    def load_index(self, index_file):
+        """ fill list from the items of index_file as of the last listing, without listing """
+        index = FileListCache(pickle_file=index_file).read_pickle_object_in_file()
+        if not index:
+            return 0
+        self.append_items(index['items'])
+        self.fill_hash_dicts()
+        self.report_skipped()
+        return len(index['items'])
+
+    def append_items(self, items):
+        """ append raw items, folders (and their missing parents) before files """
+        self.item_dict = OrderedDict()
+        for item in items:
+            if item['mimeType'] == 'application/vnd.google-apps.folder':
+                self.append_dir(item)
+        self.resolve_parents()
+        for item in items:
+            if item['mimeType'] != 'application/vnd.google-apps.folder':
+                self.append_item(item)
+
+    def apply_change(self, change):
+        """ apply item of changes.list to item_dict """
+        if change.get('removed') or 'file' not in change:
+            self.item_dict.pop(change['fileId'], None)
+        else:
+            self.item_dict[change['fileId']] = change['file']
+
+    def fill_file_list_incremental(self, index_file, rebuild_index=False, verbose=True):
+        """
+            read items and page token from index_file, apply the changes since then,
+            fall back to a full listing if there is no index or the token has expired,
+            on other errors use the cached items and list the same changes next time,
+            write the updated index
+        """
+        fcache = FileListCache(pickle_file=index_file)
+        index = None if rebuild_index else fcache.read_pickle_object_in_file()
+        page_token = None
+        if index:
+            if verbose:
+                print('list_changes')
+            self.item_dict = OrderedDict((item['id'], item) for item in index['items'])
+            try:
+                page_token = self.gdrive.list_changes(self.apply_change, index['page_token'])
+            except InvalidPageToken as exc:
+                print('page token expired %s' % exc)
+            except TExecuteException as exc:
+                print('list_changes failed %s' % exc)
+                page_token = index['page_token']
+        if page_token:
+            self.append_items(list(self.item_dict.values()))
+        else:
+            if verbose:
+                print('list_files')
+            self.item_dict = OrderedDict()
+            # take the token first, changes made while listing are applied next time
+            page_token = self.gdrive.get_start_page_token()
+            self.get_folders()
+            self.gdrive.items_processed = 0
+            self.gdrive.list_files(self.append_item)
         self.fill_hash_dicts()
-        if verbose:
-            print('update paths')
+        self.report_skipped()
+        fcache.write_pickle_object_to_file({
+            'page_token': page_token,
+            'items': list(self.item_dict.values())
+        })
+        return page_token
 
     def get_or_create_directory(self, dname):
         """ create directory on gdrive """
@@ -6,61 +6,281 @@
 from __future__ import (absolute_import, division, print_function, unicode_literals)
 
 import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
 
-from sync_app.util import walk_wrapper
+from sync_app.util import HASH_TYPES, scan_directory, to_digest
 from sync_app.file_list import FileList
-from sync_app.file_info_local import FileInfoLocal
+from sync_app.file_info_local import FileInfoLocal, flush_hashes
+
+CHECKPOINT_SIZE = 1000
+SCAN_WORKERS_PER_DEVICE = 1
+SCAN_QUEUE_SIZE = 64
+
+
+def get_device(path):
+    """ st_dev of path, None if it can't be stat'ed """
+    try:
+        return os.stat(path).st_dev
+    except OSError:
+        return None
+
+
+def fill_file_lists(flist_directories, workers_per_device=SCAN_WORKERS_PER_DEVICE):
+    """
+        fill FileListLocal objects from [(flist, directory), ...],
+        directories are grouped by st_dev, each device is walked by its own threads
+        (at most workers_per_device at a time) and the results are merged here
+    """
+    flists = []
+    for flist, _ in flist_directories:
+        if flist not in flists:
+            flists.append(flist)
+    flist_directories = [(flist, direc) for flist, direc in flist_directories
+                         if os.path.isdir(direc)]
+    for flist, direc in flist_directories:
+        flist.load_cache_subtree(direc)
+
+    devices = defaultdict(list)
+    for flist, direc in flist_directories:
+        devices[get_device(direc)].append((flist, direc))
+
+    if sum(min(workers_per_device, len(roots)) for roots in devices.values()) < 2:
+        for flist, direc in flist_directories:
+            flist.walk_directory(direc)
+    else:
+        results = Queue(maxsize=SCAN_QUEUE_SIZE)
+        stop = threading.Event()
+
+        def scan_root(flist, direc):
+            """ walk one directory in a scanning thread, None marks the end """
+            try:
+                for record in flist.iter_directories(direc):
+                    if stop.is_set():
+                        break
+                    results.put((flist, record))
+            finally:
+                results.put(None)
+
+        executors = []
+        futures = []
+        for roots in devices.values():
+            executor = ThreadPoolExecutor(max_workers=min(workers_per_device, len(roots)))
+            executors.append(executor)
+            futures.extend(executor.submit(scan_root, flist, direc) for flist, direc in roots)
+        remaining = len(futures)
+        try:
+            while remaining:
+                item = results.get()
+                if item is None:
+                    remaining -= 1
+                else:
+                    item[0].add_directory(*item[1])
+        finally:
+            stop.set()
+            while remaining:
+                if results.get() is None:
+                    remaining -= 1
+            for executor in executors:
+                executor.shutdown()
+        for future in futures:
+            future.result()
+
+    for flist in flists:
+        flist.checkpoint(force=True)
+        flist.fill_hash_dicts()
+    return flists
 
 
 class FileListLocal(FileList):
     """ File Info Local"""
 
-    def __init__(self, filelist=None, directory=None, cache_file_list=None, do_debug=False):
-        """ Init Function """
-        FileList.__init__(self, filelist=filelist, basedir=directory, filelist_type='local')
+    def __init__(self,
+                 filelist=None,
+                 directory=None,
+                 cache_file_list=None,
+                 do_debug=False,
+                 hash_types=HASH_TYPES,
+                 file_cache=None,
+                 load_cache=False,
+                 paranoid=False):
+        """
+            Init Function, hash_types are the digests computed together once one is needed,
+            entries are checkpointed to file_cache while indexing if given,
+            with load_cache the cached entries of each indexed directory are read lazily,
+            paranoid forces a full walk even for directories whose mtime is unchanged
+        """
+        FileList.__init__(
+            self,
+            filelist=filelist,
+            basedir=os.path.abspath(directory) if directory else None,
+            filelist_type='local')
         self.cache_file_list = cache_file_list
         self.do_debug = do_debug
+        self.hash_types = tuple(hash_types)
+        self.file_cache = file_cache
+        self.load_cache = load_cache
+        self.paranoid = paranoid
+        self.loaded_cache_dirs = []
+        self.cached_directories = {}
+        self.directory_info = {}
+        self.inode_dict = {}
+        self.pending_cache = []
+        self.pending_directories = []
 
-    def fill_file_list(self, directory):
-        """ Fill local file list """
+    def load_cache_subtree(self, directory):
+        """ read cached entries below directory from file_cache, once per subtree """
+        if not self.load_cache or self.file_cache is None:
+            return False
+        directory = os.path.abspath(directory)
+        if any(directory == x or directory.startswith(x + '/') for x in self.loaded_cache_dirs):
+            return False
+        if self.cache_file_list is None:
+            self.cache_file_list = FileList()
+        self.file_cache.get_cache_file_list(
+            file_list_obj=self.cache_file_list, file_info_class=FileInfoLocal, directory=directory)
+        for finfo in self.cache_file_list:
+            self.add_inode(finfo)
+        if hasattr(self.file_cache, 'get_directory_info'):
+            self.cached_directories.update(self.file_cache.get_directory_info(directory))
+        self.loaded_cache_dirs.append(directory)
+        return True
+
+    def checkpoint(self, force=False):
+        """ hand indexed entries to file_cache so an interrupted run keeps them """
+        if self.file_cache is None:
+            return False
+        if force or len(self.pending_cache) >= CHECKPOINT_SIZE:
+            self.file_cache.add_filelist_to_cache(self.pending_cache)
+            self.pending_cache = []
+            if hasattr(self.file_cache, 'add_directory_info'):
+                self.file_cache.add_directory_info(
+                    {path: self.directory_info[path]
+                     for path in self.pending_directories})
+            self.pending_directories = []
+            return True
+        return False
+
+    def add_inode(self, finfo):
+        """
+            hardlinks (same st_dev, st_ino, size and mtime) share the digests
+            already known for any of their paths
+        """
+        key = finfo.get_inode_key() if hasattr(finfo, 'get_inode_key') else None
+        if key is None:
+            return False
+        other = self.inode_dict.setdefault(key, finfo)
+        if other is not finfo:
+            finfo.copy_digests(other)
+            other.copy_digests(finfo)
+        return True
 
-        def parse_dir(_, path, filelist):
-            """ Parse directory, fill FileInfo object """
-            for fn_ in filelist:
+    def add_file(self, fullfn, fs_=None):
+        """
+            add file, reuse a cached or already indexed entry unless it was modified since,
+            fs_ is the ScanEntry (or os.stat result) of the file,
+            None for files of unchanged directories, these are not stat'ed again
+        """
+        finfo = self.filelist.get(fullfn)
+        if finfo is None and self.cache_file_list:
+            finfo = self.cache_file_list.filelist.get(fullfn)
+            if finfo is not None and hasattr(finfo, 'hash_types'):
+                # cached entries are read with the default hash_types
+                finfo.hash_types = self.hash_types
+        if finfo is not None and fs_ is not None:
+            if int(fs_.st_mtime) > int(finfo.filestat.st_mtime):
                 finfo = None
-                fullfn = os.path.abspath('%s/%s' % (path, fn_))
-                fullfn = fullfn.replace('//', '/')
-                if os.path.isfile(fullfn):
-                    fs_ = os.stat(fullfn)
-
-                    if self.cache_file_list and \
-                            fn_ in self.cache_file_list.filelist_name_dict:
-                        flist_ = self.cache_file_list.filelist_name_dict
-                        for finf_ in flist_[fn_]:
-                            if finf_.filename == fullfn:
-                                self.append(finf_)
-
-                    if fn_ in self.filelist_name_dict:
-                        for ffn in self.filelist_name_dict[fn_]:
-                            if finfo:
-                                continue
-                            if fullfn == ffn.filename:
-                                mt0 = int(fs_.st_mtime)
-                                mt1 = int(ffn.filestat.st_mtime)
-                                if mt0 > mt1:
-                                    finfo = FileInfoLocal(fn=fullfn)
-                                else:
-                                    finfo = ffn
-                    if not finfo:
-                        finfo = FileInfoLocal(fn=fullfn)
-                    self.append(finfo)
-
-        if type(directory) == list:
-            for d__ in directory:
-                if os.path.isdir(d__):
-                    walk_wrapper(d__, parse_dir, None)
+        if finfo is None:
+            if fs_ is None:
+                fs_ = os.stat(fullfn)
+            finfo = FileInfoLocal(fn=fullfn, fs=fs_, hash_types=self.hash_types)
+        self.add_inode(finfo)
+        self._append(finfo)
+        self.pending_cache.append(finfo)
+        return finfo
+
+    def iter_directories(self, directory):
+        """
+            walk directory tree, yield (path, mtime_ns, entries, files, subdirs) per directory,
+            entries is None if the directory mtime matches the cache (unless paranoid),
+            only reads self so it can run in a scanning thread
+        """
+        stack = [os.path.abspath(directory)]
+        while stack:
+            path = stack.pop()
+            try:
+                dstat = os.stat(path)
+            except OSError:
+                continue
+            mtime = getattr(dstat, 'st_mtime_ns', int(dstat.st_mtime * 1e9))
+            dinfo = self.cached_directories.get(path)
+            if dinfo is not None and dinfo[0] == mtime and not self.paranoid:
+                entries, files, subdirs = None, dinfo[1], dinfo[2]
+            else:
+                try:
+                    entries, subdirs = scan_directory(path)
+                except OSError:
+                    continue
+                prefix_len = len(os.path.join(path, ''))
+                files = [entry.path[prefix_len:] for entry in entries]
+            yield path, mtime, entries, files, subdirs
+            stack.extend(os.path.join(path, fn_) for fn_ in reversed(subdirs))
+
+    def add_directory(self, path, mtime, entries, files, subdirs):
+        """
+            add files of a directory yielded by iter_directories,
+            files of unchanged directories are neither listed nor stat'ed again
+        """
+        if entries is None:
+            for fn_ in files:
+                self.add_file(os.path.join(path, fn_))
         else:
-            if os.path.isdir(directory):
-                walk_wrapper(directory, parse_dir, None)
+            for entry in entries:
+                self.add_file(entry.path, entry)
+        self.directory_info[path] = (mtime, files, subdirs)
+        # most directories are unchanged, don't rewrite their rows on every run
+        if self.cached_directories.get(path) != self.directory_info[path]:
+            self.pending_directories.append(path)
+        self.checkpoint()
+
+    def walk_directory(self, directory):
+        """ walk directory tree adding files """
+        for record in self.iter_directories(directory):
+            self.add_directory(*record)
+
+    def fill_file_list(self, directory):
+        """ Fill local file list, several directories on different devices are walked at once """
+        if type(directory) != list:
+            directory = [directory]
+        fill_file_lists([(self, d__) for d__ in directory])
+
+    def get_digests(self, hash_types=HASH_TYPES, finfos=None):
+        """
+            compute missing digests for finfos (default every file) through the pool,
+            add them to the hash dicts
+        """
+        if finfos is None:
+            finfos = list(self)
+        finfos = [finf for finf in finfos if finf.submit_hashes(hash_types)]
+        flush_hashes()
+        for finfo in finfos:
+            for htype, digest in finfo.get_digests(hash_types).items():
+                if htype == 'md5' and digest:
+                    self.filelist_md5_dict[to_digest(digest)].append(finfo)
+                elif htype == 'sha1' and digest:
+                    self.filelist_sha1_dict[to_digest(digest)].append(finfo)
+        return len(finfos)
 
-        self.fill_hash_dicts()
+    def find_duplicates(self, htype='md5'):
+        """ group identical files, only files sharing a size are ever hashed """
+        finfos = [finf for entries in self.get_duplicate_candidates().values() for finf in entries]
+        self.get_digests(hash_types=(htype, ), finfos=finfos)
+        duplicates = defaultdict(list)
+        for finfo in finfos:
+            duplicates[finfo.get_digests((htype, ))[htype]].append(finfo)
+        return {key: val for key, val in duplicates.items() if key and len(val) > 1}
@@ -9,19 +9,29 @@ import os
 from collections import defaultdict
 
 from sync_app.file_list import FileList
+from sync_app.file_list_remote import FileListRemote
+from sync_app.folder_tree import FolderTree
 from sync_app.file_info_onedrive import (FileInfoOneDrive, BASE_DIR)
 
 
-class FileListOneDrive(FileList):
+class FileListOneDrive(FileListRemote):
     """ OneDrive File List """
+    file_info_class = FileInfoOneDrive
+    instance_attr = 'onedrive'
 
     def __init__(self, filelist=None, basedir=None, onedrive=None):
         """ Init Function """
-        FileList.__init__(self, filelist=filelist, basedir=basedir, filelist_type='onedrive')
+        FileList.__init__(
+            self,
+            filelist=filelist,
+            basedir=basedir if basedir else BASE_DIR,
+            filelist_type='onedrive')
         self.filelist_id_dict = {}
         self.directory_id_dict = {}
         self.directory_name_dict = defaultdict(dict)
+        self.item_versions = {}
         self.onedrive = onedrive
+        self.folder_tree = FolderTree(root_ids=['root'])
 
     def __getitem__(self, key):
         for dict_ in (self.filelist_id_dict, self.directory_id_dict, self.directory_name_dict):
@@ -37,6 +47,7 @@ class FileListOneDrive(FileList):
     def append_item(self, item):
         """ append file to FileList, fill dict's """
         finfo = FileInfoOneDrive(onedrive=self.onedrive, item=item)
+        self.add_version(item)
 
         ### Fix paths
         finfo.exportpath = self.get_export_path(finfo, abspath=False)
@@ -60,25 +71,22 @@ class FileListOneDrive(FileList):
         finfo = FileInfoOneDrive(onedrive=self.onedrive, item=item)
         if 'folder' not in item:
             return finfo
+        self.add_version(item)
+        return self.add_dir(finfo)
 
+    def add_dir(self, finfo):
+        """ add directory FileInfoOneDrive """
+        self.folder_tree.add(finfo.onedriveid, os.path.basename(finfo.filename), finfo.parentid)
         self.filelist_id_dict[finfo.onedriveid] = finfo
         self.directory_id_dict[finfo.onedriveid] = finfo
         self.directory_name_dict[finfo.filename][finfo.parentid] = finfo
+        return finfo
 
     def get_export_path(self, finfo, abspath=True, is_dir=False):
         """ determine export path for given finfo object"""
-        fullpath = []
+        fullpath = self.folder_tree.get_path(finfo.parentid)
         if is_dir:
-            fullpath.append(finfo.filename)
-        pid = finfo.parentid
-        while pid != 'root':
-            if pid in self.filelist_id_dict:
-                finf = self.filelist_id_dict[pid]
-                pid = finf.parentid
-                fullpath.append(os.path.basename(finf.filename))
-            else:
-                raise ValueError('no parent %s' % pid)
-        fullpath = '/'.join(fullpath[::-1])
+            fullpath = '%s/%s' % (fullpath, finfo.filename) if fullpath else finfo.filename
         if not fullpath:
             fullpath = 'OneDrive'
         elif 'OneDrive' not in fullpath:
@@ -95,23 +103,6 @@ class FileListOneDrive(FileList):
         for _, finfo in self.directory_id_dict.items():
             finfo.exportpath = self.get_export_path(finfo, is_dir=True)
 
-    def fill_file_list(self, number_to_process=-1, searchstr=None, verbose=True):
-        """ fill OneDrive file list"""
-        if not self.onedrive:
-            raise Exception('what happened?')
-        if verbose:
-            print('get_folders')
-        self.onedrive.number_to_process = -1
-        self.onedrive.get_folders(self.append_dir)
-        if verbose:
-            print('list_files')
-        self.onedrive.number_to_process = number_to_process
-        self.onedrive.items_processed = 0
-        self.onedrive.list_files(self.append_item)
-        self.fill_hash_dicts()
-        if verbose:
-            print('update paths')
-
     def get_or_create_directory(self, dname):
         """ create directory on onedrive """
         pid_ = 'root'
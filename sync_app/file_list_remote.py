@@ -0,0 +1,152 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    FileListRemote class, base of the box and onedrive file lists,
+    lists folders then files, reads and writes the list to FileListCacheRemote
+"""
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+from sync_app.file_list import FileList
+from sync_app.file_cache_remote import RemoteEntry, get_item_version
+
+
+class FileListRemote(FileList):
+    """
+        remote file list with filelist_id_dict, directory_id_dict and item_versions,
+        subclasses set file_info_class and instance_attr (name of the api instance attribute)
+    """
+    file_info_class = None
+    instance_attr = None
+
+    def add_version(self, item):
+        """ remember the version of a listed item, written to the cache with its entry """
+        self.item_versions[item['id']] = get_item_version(item)
+
+    def fill_file_list(self,
+                       number_to_process=-1,
+                       searchstr=None,
+                       verbose=True,
+                       remote_cache=None):
+        """
+            fill file list from the api, folders first,
+            with remote_cache the listing revalidates the cached entries,
+            only the entries which changed are written back
+        """
+        instance = getattr(self, self.instance_attr)
+        if not instance:
+            raise Exception('what happened?')
+        if remote_cache is not None:
+            remote_cache.read_entries(self.filelist_type)
+        if verbose:
+            print('get_folders')
+        instance.number_to_process = -1
+        instance.get_folders(self.append_dir)
+        if verbose:
+            print('list_files')
+        instance.number_to_process = number_to_process
+        instance.items_processed = 0
+        instance.list_files(self.append_item)
+        self.fill_hash_dicts()
+        if verbose:
+            print('update paths')
+        if remote_cache is not None:
+            self.write_cache(remote_cache, complete=number_to_process < 0)
+
+    def load_cache(self, remote_cache):
+        """ fill list from remote_cache (FileListCacheRemote) without api calls """
+        entries = remote_cache.read_entries(self.filelist_type)
+        instance = getattr(self, self.instance_attr)
+        for remote_id, entry in entries.items():
+            finfo = self.file_info_class(in_tuple=entry.cache_tuple)
+            setattr(finfo, self.instance_attr, instance)
+            finfo.parentid = entry.parentid
+            self.item_versions[remote_id] = entry.version
+            if entry.is_folder:
+                self.add_dir(finfo)
+            else:
+                self.append(finfo)
+        self.fill_hash_dicts()
+        return len(entries)
+
+    def write_cache(self, remote_cache, complete=False):
+        """
+            write files and folders with their parent ids to remote_cache,
+            complete: the list is a full listing, cached entries missing from it are deleted
+        """
+        entries = {}
+        for fid, finfo in self.filelist_id_dict.items():
+            entries[fid] = RemoteEntry(finfo.parentid, fid in self.directory_id_dict,
+                                       self.item_versions.get(fid), finfo.output_cache_tuple())
+        return remote_cache.write_entries(self.filelist_type, entries, complete=complete)
+
+
+def test_file_list_remote():
+    """ test FileListRemote.write_cache and FileListRemote.load_cache """
+    import os
+    import tempfile
+    from sync_app.file_cache_remote import FileListCacheRemote
+    from sync_app.file_info_box import FileInfoBox
+    from sync_app.file_list_box import FileListBox
+
+    box = object()
+    flist = FileListBox(box=box)
+    flist.add_dir(FileInfoBox(gid='d1', fn='docs', pid='0'))
+    flist.append(FileInfoBox(gid='f1', fn='/tmp/Box/docs/a.txt', sha1='%040x' % 1, pid='d1'))
+
+    tmpdir = tempfile.mkdtemp()
+    fcache = FileListCacheRemote(sqlite_file='%s/remote.sqlite' % tmpdir)
+    assert flist.write_cache(fcache, complete=True) == 2
+
+    flist = FileListBox(box=box)
+    assert flist.load_cache(fcache) == 2
+    assert list(flist.directory_id_dict) == ['d1']
+    finfo = flist.filelist_id_dict['f1']
+    assert finfo.box is box
+    assert (finfo.filename, finfo.parentid, finfo.sha1sum) == ('/tmp/Box/docs/a.txt', 'd1',
+                                                               '%040x' % 1)
+    fcache.close()
+    os.remove('%s/remote.sqlite' % tmpdir)
+    os.rmdir(tmpdir)
+
+
+def test_file_list_remote_revalidate():
+    """ test FileListRemote.fill_file_list only writes entries which changed """
+    import os
+    import tempfile
+    from sync_app.file_cache_remote import FileListCacheRemote
+    from sync_app.file_list_box import FileListBox
+
+    class FakeBox(object):
+        """ lists the folder and file items it holds """
+
+        def __init__(self, items):
+            self.items = items
+
+        def get_folders(self, callback_fn):
+            for item in self.items:
+                if item.get('type') == 'folder':
+                    callback_fn(item)
+
+        def list_files(self, callback_fn):
+            for item in self.items:
+                if item.get('type') != 'folder':
+                    callback_fn(item)
+
+    items = [{'id': 'd1', 'name': 'docs', 'parentid': '0', 'type': 'folder', 'etag': '0'}]
+    items.extend({'id': 'f%d' % idx, 'name': '%d.txt' % idx, 'parentid': 'd1', 'type': 'file',
+                  'etag': '0', 'sha1': '%040x' % idx} for idx in range(10))
+    tmpdir = tempfile.mkdtemp()
+    sqlite_file = '%s/remote.sqlite' % tmpdir
+    changes = []
+    for idx in range(3):
+        if idx == 2:
+            items[3]['etag'] = '1'
+        fcache = FileListCacheRemote(sqlite_file=sqlite_file)
+        flist = FileListBox(box=FakeBox(items))
+        flist.fill_file_list(verbose=False, remote_cache=fcache)
+        changes.append(fcache.conn.total_changes)
+        fcache.close()
+    # st_mtime of items without modified_at is the listing time, only the etag is compared
+    assert changes == [11, 0, 1]
+    os.remove(sqlite_file)
+    os.rmdir(tmpdir)
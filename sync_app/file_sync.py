@@ -8,7 +8,8 @@
 from __future__ import (absolute_import, division, print_function, unicode_literals)
 import os
 
-from sync_app.util import MIMETYPE_SUFFIXES, GOOGLEAPP_MIMETYPES
+from sync_app.file_diff import diff_file_lists, iter_diff
+from sync_app.sync_plan import SyncAction, SyncPlan, SyncExecutor, SYNC_WORKERS
 
 
 def compare_objects(obj0, obj1, use_sha1=False):
@@ -45,6 +46,7 @@ class FileSync(object):
     def __init__(self, flists=None):
         """ Init function """
         self.flists = []
+        self.hash_stats = {'hashed': 0, 'skipped': 0, 'fingerprinted': 0}
         if flists:
             for flist in flists:
                 if not all(
@@ -56,93 +58,174 @@ class FileSync(object):
     def __repr__(self):
         return '%s' % ' '.join(self.flists)
 
-    def compare_lists(self, callback0=None, callback1=None, use_sha1=False):
-        """ Compare file lists """
+    def diff_lists(self, use_sha1=False, match_relpath=False):
+        """ structured bulk diff (FileDiff) of the first list against each other list """
+        return [
+            diff_file_lists(self.flists[0], flist, use_sha1=use_sha1, match_relpath=match_relpath)
+            for flist in self.flists[1:]
+        ]
+
+    def iter_actions(self, use_sha1=False, match_relpath=False):
+        """
+            Compare the first file list against each other list (see file_diff.iter_diff),
+            yield SyncActions as soon as they are decided,
+            with match_relpath files are matched by path relative to each list's basedir
+            (filelist_relpath_dict) instead of by basename, so each file is compared once
+        """
         if len(self.flists) < 2:
-            return None
+            return
 
-        list_a_not_b = []
-        list_b_not_a = []
-
-        for fn_ in self.flists[0].filelist_name_dict:
-            finfo0 = self.flists[0].filelist_name_dict[fn_]
-            _md = finfo0[0].md5sum
-            fmd5_0 = _md if _md else finfo0[0].get_md5()
-            if use_sha1:
-                _sh = finfo0[0].sha1sum
-                fmd5_0 = _sh if _sh else finfo0[0].get_sha1()
-            fmtim0 = finfo0[0].filestat.st_mtime
-            for flist in self.flists[1:]:
-                hash_dict = flist.filelist_md5_dict
-                if use_sha1:
-                    hash_dict = flist.filelist_sha1_dict
-                if fn_ not in flist.filelist_name_dict:
-                    tmp = fn_.split('.')[-2:]
-                    if len(tmp) > 1 and tmp[0] == tmp[1]:
-                        test = '.'.join(fn_.split('.')[:-1])
-                        if test in self.flists[0].filelist_name_dict:
-                            continue
-                    fn_exists = False
-                    fmtim1 = -1
-                    for finf in finfo0:
-                        if ('application/vnd.google-apps' in getattr(finf, 'mimetype', '')):
-                            mtype = getattr(finf, 'mimetype')
-                            mtype = GOOGLEAPP_MIMETYPES.get(mtype)
-                            ext = MIMETYPE_SUFFIXES.get(mtype)
-                            fnexp = '%s.%s' % (finf.filename, ext)
-                            if (os.path.exists(finf.filename) or os.path.exists(fnexp)):
-                                fn_exists = True
-                                fmtim1 = finf.filestat.st_mtime
-                    if fn_exists:
-                        continue
-                    list_a_not_b.append(finfo0)
-                elif fmd5_0 not in hash_dict:
-                    tmp = flist.filelist_name_dict[fn_][0]
-                    fmd5_1 = tmp.md5sum if tmp.md5sum else tmp.get_md5()
-                    if use_sha1:
-                        fmd5_1 = tmp.sha1sum if tmp.sha1sum else tmp.get_sha1()
-                    fmtim1 = tmp.filestat.st_mtime
-                    fmtim1 += 12 * 3600
-                    if fmtim0 > fmtim1:
-                        print('compare lists', fn_, fmd5_0, fmd5_1, fmtim0, fmtim1)
-                    if fmd5_0 != fmd5_1 and fmtim0 > fmtim1:
-                        print('compare fn=%s, ' % fn_ + 'fname=%s, ' % tmp.filename +
-                              'ft0=%s, ft1=%s, ' % (fmtim0, fmtim1) + 'fm0=%s, fm1=%s' % (fmd5_0,
-                                                                                          fmd5_1))
-                        list_a_not_b.append(finfo0)
+        htype = 'sha1' if use_sha1 else 'md5'
+        nmissing = sum(1 for flist in self.flists for finfo in flist
+                       if hasattr(finfo, 'has_digest') and not finfo.has_digest(htype))
+        self.hash_stats = {'hashed': 0, 'skipped': nmissing, 'fingerprinted': 0}
+        source = self.flists[0].filelist_type
 
         for flist in self.flists[1:]:
-            for fn_, finfo1 in flist.filelist_name_dict.items():
-                if fn_ not in self.flists[0].filelist_name_dict:
-                    tmp = fn_.split('.')[-2:]
-                    if len(tmp) > 1 and tmp[0] == tmp[1]:
-                        test = '.'.join(fn_.split('.')[:-1])
-                        if test in self.flists[0].filelist_name_dict:
-                            continue
-                    fn_exists = False
-                    for finf in finfo1:
-                        if finf.filename in self.flists[0].filelist:
-                            fn_exists = True
-                    if fn_exists:
-                        continue
-                    list_b_not_a.append(finfo1)
-
-        for finfo in list_a_not_b:
-            if callback0:
-                finf_ = finfo
-                if type(finf_) == list:
-                    finf_ = finfo[0]
-                callback0(finf_)
-
-        for finfo in list_b_not_a:
-            if callback1:
-                finf_ = finfo
-                if type(finf_) == list:
-                    finf_ = finfo[0]
-                callback1(finf_)
+            target = flist.filelist_type
+            for action, finfo0, finfo1 in iter_diff(self.flists[0], flist, use_sha1=use_sha1,
+                                                    match_relpath=match_relpath,
+                                                    stats=self.hash_stats):
+                if action == 'b_not_a':
+                    yield SyncAction(action, finfo0, None, target, source)
+                    continue
+                if action == 'modified':
+                    print('compare fname0=%s, fname1=%s, ' % (finfo0.filename, finfo1.filename) +
+                          'ft0=%s, ft1=%s, ' % (finfo0.filestat.st_mtime,
+                                                finfo1.filestat.st_mtime) +
+                          'fs0=%s, fs1=%s' % (finfo0.filestat.st_size, finfo1.filestat.st_size))
+                yield SyncAction(action, finfo0, finfo1, source, target)
+            self.hash_stats['skipped'] = nmissing - self.hash_stats['hashed']
+
+    def get_plan(self, use_sha1=False, match_relpath=False):
+        """ SyncPlan of every action of iter_actions """
+        return SyncPlan(self.iter_actions(use_sha1=use_sha1, match_relpath=match_relpath))
+
+    def compare_lists(self, callback0=None, callback1=None, use_sha1=False, match_relpath=False):
+        """
+            Compare file lists, once the whole comparison is done
+            callback0 is called for files only in (or newer in) the first list,
+            then callback1 for files missing from the first list
+        """
+        if len(self.flists) < 2:
+            return None
+        plan = self.get_plan(use_sha1=use_sha1, match_relpath=match_relpath)
+        if callback0:
+            for action in plan:
+                if action.action != 'b_not_a':
+                    callback0(action.finfo)
+        if callback1:
+            for action in plan.get_actions('b_not_a'):
+                callback1(action.finfo)
+
+    def sync_lists(self,
+                   callback0=None,
+                   callback1=None,
+                   use_sha1=False,
+                   match_relpath=False,
+                   max_workers=SYNC_WORKERS,
+                   backend_limits=None):
+        """
+            like compare_lists, but the callbacks run on a SyncExecutor
+            while the comparison is still going on, returns the callback results
+        """
+        callbacks = {'a_not_b': callback0, 'modified': callback0, 'b_not_a': callback1}
+        executor = SyncExecutor(callbacks, max_workers=max_workers, backend_limits=backend_limits)
+        return executor.run(self.iter_actions(use_sha1=use_sha1, match_relpath=match_relpath))
 
 
 def test_file_sync():
     """ test FileSync """
     tmp = FileSync(flists=range(20))
     assert '%s' % tmp == ''
+
+
+def test_compare_lists_lazy():
+    """ test FileSync.compare_lists only hashes ambiguous files """
+    from sync_app.file_info import FileInfo, StatTuple
+    from sync_app.file_info_local import FileInfoLocal
+    from sync_app.file_list import FileList
+
+    fn_ = os.path.abspath('tests/test_dir/hello_world.txt')
+    fn1 = os.path.abspath('tests/test_dir/goodbye_world.txt')
+    flist0 = FileList(filelist_type='remote')
+    flist0.append(FileInfo(fn=fn_, md5='8ddd8be4b179a529afa5f2ffae4b9858',
+                           fs=StatTuple(st_mtime=2**31, st_size=13)))
+    flist0.append(FileInfo(fn=fn1, md5='0' * 32, fs=StatTuple(st_mtime=0, st_size=21)))
+    flist1 = FileList()
+    flist1.append(FileInfoLocal(fn=fn_))
+    flist1.append(FileInfoLocal(fn=fn1))
+    output = []
+    fsync = FileSync(flists=[flist0, flist1])
+    fsync.compare_lists(callback0=output.append, callback1=output.append)
+    assert output == []
+    assert fsync.hash_stats == {'hashed': 1, 'skipped': 1, 'fingerprinted': 0}
+
+    flist0 = FileList(filelist_type='remote')
+    flist0.append(FileInfo(fn=fn1, md5='0' * 32, fs=StatTuple(st_mtime=2**31, st_size=22)))
+    fsync = FileSync(flists=[flist0, flist1])
+    fsync.compare_lists(callback0=output.append)
+    assert [x.filename for x in output] == [fn1]
+    assert fsync.hash_stats == {'hashed': 0, 'skipped': 1, 'fingerprinted': 0}
+
+
+def test_compare_lists_fingerprint():
+    """ test FileSync.compare_lists rules out local files by fingerprint """
+    import shutil
+    import tempfile
+    from sync_app.file_info import StatTuple
+    from sync_app.file_info_local import FileInfoLocal
+    from sync_app.file_list import FileList
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        flists = []
+        for direc, content, mtime in (('a', 'aaaa', 2**31), ('b', 'bbbb', 0)):
+            os.makedirs('%s/%s' % (tmpdir, direc))
+            fn_ = '%s/%s/test.txt' % (tmpdir, direc)
+            with open(fn_, 'w') as outfile:
+                outfile.write(content)
+            flist = FileList()
+            flist.append(FileInfoLocal(fn=fn_, fs=StatTuple(st_mtime=mtime, st_size=4)))
+            flists.append(flist)
+        output = []
+        fsync = FileSync(flists=flists)
+        fsync.compare_lists(callback0=output.append)
+        assert [x.filename for x in output] == ['%s/a/test.txt' % tmpdir]
+        assert fsync.hash_stats == {'hashed': 0, 'skipped': 2, 'fingerprinted': 2}
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_compare_lists_relpath():
+    """ test FileSync.compare_lists matching by relative path """
+    from sync_app.file_info import FileInfo, StatTuple
+    from sync_app.file_list import FileList
+
+    flists = []
+    for basedir, files in (('/a', (('x/index.html', 1, 2**31), ('y/index.html', 2, 2**31))),
+                           ('/b', (('y/index.html', 2, 0), ('z/index.html', 3, 0)))):
+        flist = FileList(basedir=basedir)
+        for fn_, size, mtime in files:
+            flist.append(
+                FileInfo(fn='%s/%s' % (basedir, fn_), md5='%032x' % size,
+                         fs=StatTuple(st_mtime=mtime, st_size=size)))
+        flist.fill_hash_dicts()
+        flists.append(flist)
+    fsync = FileSync(flists=flists)
+    # by basename only /a/x/index.html and /b/y/index.html are compared, /b/z is missed
+    for match_relpath, expected1 in ((False, []), (True, ['/b/z/index.html'])):
+        output0, output1 = [], []
+        fsync.compare_lists(callback0=output0.append, callback1=output1.append,
+                            match_relpath=match_relpath)
+        assert [x.filename for x in output0] == ['/a/x/index.html']
+        assert [x.filename for x in output1] == expected1
+    diff = fsync.diff_lists(match_relpath=True)[0]
+    assert [x.filename for x in diff.a_not_b] == ['/a/x/index.html']
+    assert [x.filename for x in diff.b_not_a] == ['/b/z/index.html']
+    assert diff.modified == []
+    plan = fsync.get_plan(match_relpath=True)
+    assert [(x.action, x.finfo.filename) for x in plan] == [('a_not_b', '/a/x/index.html'),
+                                                            ('b_not_a', '/b/z/index.html')]
+    assert sorted(fsync.sync_lists(callback0=lambda x: 0, callback1=lambda x: 1,
+                                   match_relpath=True)) == [0, 1]
@@ -0,0 +1,114 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    FolderTree class, folder topology of a remote (gdrive, box, onedrive) file list,
+    paths are built once per folder and cached, a rename/move drops the cached paths
+    of the folder and everything below it
+"""
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+from collections import defaultdict
+
+
+class FolderTree(object):
+    """ folder id -> (name, parent id), with a path cache per folder """
+
+    def __init__(self, root_ids=(), fetch_fn=None):
+        """
+            root_ids: parent ids which terminate a path (None always does),
+            fetch_fn(fid): called for unknown folders, expected to add them
+        """
+        self.root_ids = set(root_ids) | set([None])
+        self.fetch_fn = fetch_fn
+        self.nodes = {}
+        self.children = defaultdict(set)
+        self.paths = {}
+
+    def __contains__(self, fid):
+        return fid in self.nodes
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def add(self, fid, name, parentid):
+        """ add or update folder """
+        node = self.nodes.get(fid)
+        if node == (name, parentid):
+            return
+        if node is not None:
+            self.children[node[1]].discard(fid)
+            self.invalidate(fid)
+        self.nodes[fid] = (name, parentid)
+        self.children[parentid].add(fid)
+
+    def remove(self, fid):
+        """ remove folder """
+        node = self.nodes.pop(fid, None)
+        if node is not None:
+            self.children[node[1]].discard(fid)
+            self.invalidate(fid)
+
+    def invalidate(self, fid):
+        """ drop cached paths of fid and its descendants """
+        stack = [fid]
+        while stack:
+            fid = stack.pop()
+            # a cached path implies cached paths of all ancestors, so stop at uncached folders
+            if self.paths.pop(fid, None) is None:
+                continue
+            stack.extend(self.children.get(fid, ()))
+
+    def get_path(self, fid):
+        """ folder names from the top folder down to fid joined by '/', '' for a root id """
+        chain = []
+        pid = fid
+        while pid not in self.root_ids and pid not in self.paths:
+            if pid not in self.nodes and self.fetch_fn is not None:
+                self.fetch_fn(pid)
+            if pid not in self.nodes:
+                raise ValueError('no parent %s' % pid)
+            if len(chain) > len(self.nodes):
+                raise ValueError('cycle at %s' % pid)
+            chain.append(pid)
+            pid = self.nodes[pid][1]
+        path = '' if pid in self.root_ids else self.paths[pid]
+        for cid in reversed(chain):
+            name = self.nodes[cid][0]
+            path = '%s/%s' % (path, name) if path else name
+            self.paths[cid] = path
+        return path
+
+
+def test_folder_tree():
+    """ test FolderTree """
+    from nose.tools import raises
+
+    tree = FolderTree(root_ids=['0'])
+    tree.add('a', 'A', '0')
+    tree.add('b', 'B', 'a')
+    tree.add('c', 'C', 'b')
+    tree.add('d', 'D', '0')
+    assert tree.get_path('c') == 'A/B/C'
+    assert tree.get_path('0') == ''
+    assert sorted(tree.paths) == ['a', 'b', 'c']
+
+    tree.add('b', 'B', 'd')
+    assert sorted(tree.paths) == ['a']
+    assert tree.get_path('c') == 'D/B/C'
+    tree.add('d', 'E', '0')
+    assert tree.get_path('c') == 'E/B/C'
+    assert tree.get_path('a') == 'A'
+
+    tree.remove('b')
+    assert 'b' not in tree and len(tree) == 3
+
+    @raises(ValueError)
+    def test_tmp():
+        """ ... """
+        tree.get_path('c')
+
+    test_tmp()
+
+    tree = FolderTree(fetch_fn=lambda fid: tree.add(fid, 'My Drive', None))
+    tree.add('x', 'X', 'root')
+    assert tree.get_path('x') == 'My Drive/X'
@@ -8,6 +8,7 @@ from __future__ import (absolute_import, division, print_function, unicode_liter
 import os
 import socket
 import time
+import threading
 import httplib2
 import oauth2client
 import oauth2client.file
@@ -15,6 +16,10 @@ from oauth2client import client, tools
 from apiclient import discovery
 from apiclient.http import MediaIoBaseDownload
 from apiclient.errors import HttpError
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 SCOPES = 'https://www.googleapis.com/auth/drive'
 CLIENT_SECRET_FILE = 'sync_app/client_secrets.json'
@@ -23,13 +28,41 @@ APPLICATION_NAME = 'Python API'
 fields = ', '.join(('id', 'name', 'md5Checksum', 'modifiedTime', 'size', 'parents', 'fileExtension',
                     'mimeType', 'webContentLink', 'owners'))
 list_fields = 'kind, nextPageToken, incompleteSearch, files(%s)' % fields
+change_fields = 'kind, nextPageToken, newStartPageToken, changes(fileId, removed, file(%s))' % \
+    fields
 CHUNKSIZE = 2 * 1024 * 1024
+BATCH_SIZE = 100
+# pages fetched ahead of the callbacks per query
+PREFETCH_PAGES = 2
+
+
+def modified_time_shards(boundaries):
+    """
+        query clauses splitting files.list by modifiedTime at boundaries (sorted RFC 3339
+        dates), e.g. ['2014-01-01', '2016-01-01'] gives three disjoint shards covering everything
+    """
+    shards = []
+    lower = None
+    for bound in list(boundaries) + [None]:
+        clauses = []
+        if lower:
+            clauses.append('modifiedTime >= "%s"' % lower)
+        if bound:
+            clauses.append('modifiedTime < "%s"' % bound)
+        shards.append(' and '.join(clauses))
+        lower = bound
+    return shards
 
 
 class TExecuteException(Exception):
     pass
 
 
+class InvalidPageToken(TExecuteException):
+    """ changes.list page token has expired or isn't valid (HTTP 410, or 400 on pageToken) """
+    pass
+
+
 def get_credentials():
     """Gets valid user credentials from storage.
 
@@ -55,10 +88,13 @@ def get_credentials():
     return credentials
 
 
-def t_execute(request):
+def t_execute(request, http=None):
+    """ execute request, retry on socket errors and rate limits, http: Http to use instead """
     timeout = 1
     while True:
         try:
+            if http is not None:
+                return request.execute(http=http)
             return request.execute()
         except socket.error:
             time.sleep(timeout)
@@ -75,6 +111,9 @@ def t_execute(request):
                     raise
             elif 'sufficient permissions' in content.lower():
                 raise TExecuteException('insufficient permission')
+            elif exc.resp.status == 410 or (exc.resp.status == 400 and
+                                            'pagetoken' in content.lower()):
+                raise InvalidPageToken(exc._get_reason())
             elif exc._get_reason() == 'Invalid Value':
                 raise TExecuteException('Invalid Value')
             else:
@@ -86,8 +125,16 @@ def t_execute(request):
 class GdriveInstance(object):
     """ class to make use of google python api """
 
-    def __init__(self, app='drive', version='v3', number_to_process=-1):
-        """ init function """
+    def __init__(self,
+                 app='drive',
+                 version='v3',
+                 number_to_process=-1,
+                 service=None,
+                 list_shards=None):
+        """
+            init function, service is built from the stored credentials unless given,
+            list_shards: default shards of list_files/get_folders, see modified_time_shards
+        """
 
         self.list_of_keys = {}
         self.list_of_mimetypes = {}
@@ -95,9 +142,14 @@ class GdriveInstance(object):
         self.list_of_folders = {}
         self.list_of_items = {}
 
-        self.credentials = get_credentials()
-        http = self.credentials.authorize(httplib2.Http())
-        self.service = discovery.build(app, version, http=http)
+        self.credentials = None
+        self.local = threading.local()
+        self.list_shards = list_shards
+
+        if service is None:
+            self.credentials = get_credentials()
+            service = discovery.build(app, version, http=self.get_http())
+        self.service = service
         self.gfiles = self.service.files()
 
         self.number_to_process = number_to_process
@@ -116,56 +168,159 @@ class GdriveInstance(object):
             self.items_processed += 1
         return 1
 
-    def process_request(self, request, args={}, callback_fn=None):
-        """ call process_response until new_request exists or until stopped """
-        original_request = request
-        response = t_execute(request)
-
-        new_request = True
-        while new_request:
-            if self.process_response(response, callback_fn) == 0:
-                return
-            next_token = response.get('nextPageToken', None)
+    def get_http(self):
+        """ httplib2.Http isn't thread safe, one authorized Http per thread """
+        if self.credentials is None:
+            return None
+        if not hasattr(self.local, 'http'):
+            self.local.http = self.credentials.authorize(httplib2.Http())
+        return self.local.http
+
+    def iter_pages(self, request, args):
+        """ response of request and of each following page (files.list(pageToken=...)) """
+        args = dict(args)
+        http = self.get_http()
+        response = t_execute(request, http=http)
+        while True:
+            yield response
+            next_token = response.get('nextPageToken', None) if response else None
             if next_token is None:
                 return
-
             args['pageToken'] = next_token
-            new_request = self.gfiles.list(**args)
-            if not new_request:
-                return
-            request = new_request
+            request = self.gfiles.list(**args)
             try:
-                response = t_execute(request)
-            except HttpError:
-                time.sleep(5)
-                print('HttpError')
-                response = t_execute(request)
+                try:
+                    response = t_execute(request, http=http)
+                except HttpError:
+                    time.sleep(5)
+                    print('HttpError')
+                    response = t_execute(request, http=http)
             except TExecuteException as exc:
                 print('invalid next token %s' % exc)
-        return
+                return
 
-    def list_files(self, callback_fn, searchstr=None):
+    def fetch_pages(self, pages, pages_queue, stop):
+        """ put each page of pages into pages_queue, then None, in a separate thread """
+
+        def put(item):
+            """ put unless stopped, blocks while pages_queue is full """
+            while not stop.is_set():
+                try:
+                    pages_queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            for response in pages:
+                if not put(response):
+                    return
+        except Exception as exc:
+            put(exc)
+        put(None)
+
+    def process_pages(self, pages_list, callback_fn=None):
+        """
+            call process_response for each page of every iterator in pages_list,
+            each one is fetched in its own thread, at most PREFETCH_PAGES ahead of
+            the callbacks, which run in the calling thread
+        """
+        pages_queue = queue.Queue(maxsize=PREFETCH_PAGES * len(pages_list))
+        stop = threading.Event()
+        for pages in pages_list:
+            thread = threading.Thread(target=self.fetch_pages, args=(pages, pages_queue, stop))
+            thread.daemon = True
+            thread.start()
+        running = len(pages_list)
+        try:
+            while running:
+                response = pages_queue.get()
+                if response is None:
+                    running -= 1
+                elif isinstance(response, Exception):
+                    raise response
+                elif self.process_response(response, callback_fn) == 0:
+                    return
+        finally:
+            stop.set()
+
+    def process_request(self, request, args={}, callback_fn=None):
+        """ call process_response for each page, the next page is fetched meanwhile """
+        return self.process_pages([self.iter_pages(request, args)], callback_fn)
+
+    def process_query(self, query_string, callback_fn, shards=None):
+        """
+            files.list of query_string, split into one concurrent query per shard
+            (see modified_time_shards) if shards are given
+        """
+        if shards is None:
+            shards = self.list_shards
+        pages_list = []
+        for shard in shards or [None]:
+            args = {'q': query_string, 'fields': list_fields}
+            if shard:
+                args['q'] = '%s and %s' % (query_string, shard)
+            pages_list.append(self.iter_pages(self.gfiles.list(**args), args))
+        return self.process_pages(pages_list, callback_fn)
+
+    def list_files(self, callback_fn, searchstr=None, shards=None):
         """ list non-directory files """
         query_string = 'mimeType != "application/vnd.google-apps.folder"'
         if searchstr:
             query_string += ' and name contains "%s"' % searchstr
-
-        args = {'q': query_string, 'fields': list_fields}
-        request = self.gfiles.list(**args)
-        return self.process_request(request, args, callback_fn)
+        return self.process_query(query_string, callback_fn, shards)
+
+    def get_start_page_token(self):
+        """ token of the current state of the drive, where list_changes starts from """
+        request = self.service.changes().getStartPageToken()
+        return t_execute(request)['startPageToken']
+
+    def list_changes(self, callback_fn, page_token):
+        """
+            callback_fn applied to each change since page_token,
+            returns the token to start from next time,
+            raises InvalidPageToken if page_token is no longer valid
+        """
+        while True:
+            request = self.service.changes().list(
+                pageToken=page_token, pageSize=1000, spaces='drive', fields=change_fields)
+            response = t_execute(request)
+            for change in response.get('changes', []):
+                callback_fn(change)
+            if 'newStartPageToken' in response:
+                return response['newStartPageToken']
+            page_token = response['nextPageToken']
 
     def get_file(self, fid):
         request = self.gfiles.get(fileId=fid, fields=fields)
         return t_execute(request)
 
-    def get_folders(self, callback_fn, searchstr=None):
+    def get_files(self, fids):
+        """ files.get of many ids, BATCH_SIZE per batch request, ids which fail are skipped """
+        output = []
+
+        def callback(request_id, response, exception):
+            """ called for each request of the batch """
+            if exception is not None:
+                print('get_files %s %s' % (request_id, exception))
+            else:
+                output.append(response)
+
+        fids = list(fids)
+        for idx in range(0, len(fids), BATCH_SIZE):
+            batch = self.service.new_batch_http_request(callback=callback)
+            for fid in fids[idx:idx + BATCH_SIZE]:
+                batch.add(self.gfiles.get(fileId=fid, fields=fields), request_id=fid)
+            t_execute(batch)
+        return output
+
+    def get_folders(self, callback_fn, searchstr=None, shards=None):
         """ get folders """
         query_string = 'mimeType = "application/vnd.google-apps.folder"'
         if searchstr:
             query_string += ' and name contains "%s"' % searchstr
-        args = {'q': query_string, 'fields': list_fields}
-        request = self.gfiles.list(**args)
-        return self.process_request(request, args, callback_fn)
+        return self.process_query(query_string, callback_fn, shards)
 
     def download(self, fileid, exportfile, md5sum=None, export_mimetype=None):
         """ download using dlink url """
@@ -0,0 +1,161 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    sync plans and their execution
+    SyncAction: one typed decision of FileSync (copy a new/modified file, copy back a missing one)
+    SyncPlan: list of SyncActions
+    SyncExecutor: run SyncActions on a bounded thread pool while they are still being produced
+"""
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+ACTION_TYPES = ('a_not_b', 'modified', 'b_not_a')
+
+SYNC_WORKERS = 4
+
+# the remote instances share a single client/connection, don't use them concurrently,
+# backends which aren't listed are only bounded by the pool size
+BACKEND_LIMITS = {'gdrive': 1, 'onedrive': 1, 'box': 1, 's3': 1}
+
+SyncAction = namedtuple('SyncAction', ['action', 'finfo', 'other', 'source', 'target'])
+
+
+class SyncPlan(object):
+    """ list of SyncActions """
+
+    def __init__(self, actions=None):
+        self.actions = []
+        if actions:
+            for action in actions:
+                self.append(action)
+
+    def __repr__(self):
+        return '<SyncPlan(%s)>' % ', '.join(
+            '%s=%s' % (atype, len(self.get_actions(atype))) for atype in ACTION_TYPES)
+
+    def __iter__(self):
+        return iter(self.actions)
+
+    def __len__(self):
+        return len(self.actions)
+
+    def append(self, action):
+        if action.action not in ACTION_TYPES:
+            raise ValueError('unknown action %s' % action.action)
+        self.actions.append(action)
+
+    def get_actions(self, action_type):
+        """ actions of given type """
+        return [action for action in self.actions if action.action == action_type]
+
+
+class SyncExecutor(object):
+    """
+        run SyncActions with callbacks[action.action](action.finfo) on a pool of max_workers
+        threads, at most backend_limits[backend] actions touch a backend at once,
+        actions are consumed as they are produced, at most 2 * max_workers are queued
+    """
+
+    def __init__(self, callbacks, max_workers=SYNC_WORKERS, backend_limits=None):
+        self.callbacks = callbacks
+        self.max_workers = max_workers
+        limits = dict(BACKEND_LIMITS)
+        limits.update(backend_limits or {})
+        self.backend_locks = {
+            backend: threading.BoundedSemaphore(limit)
+            for backend, limit in limits.items() if limit
+        }
+
+    def run_action(self, action):
+        """ run callback of action holding its backends' locks, in a fixed order """
+        callback = self.callbacks.get(action.action)
+        if callback is None:
+            return None
+        locks = [
+            self.backend_locks[backend] for backend in sorted(set([action.source, action.target]))
+            if backend in self.backend_locks
+        ]
+        for lock in locks:
+            lock.acquire()
+        try:
+            return callback(action.finfo)
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def run(self, actions):
+        """
+            run actions (any iterable, e.g. FileSync.iter_actions), return the callback results
+            in the order of actions, the first exception is raised once every action finished
+        """
+        slots = threading.BoundedSemaphore(2 * self.max_workers)
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for action in actions:
+                slots.acquire()
+                future = executor.submit(self.run_action, action)
+                future.add_done_callback(lambda _: slots.release())
+                futures.append(future)
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        if errors:
+            raise errors[0]
+        return [future.result() for future in futures]
+
+
+def test_sync_plan():
+    """ test SyncPlan """
+    from nose.tools import raises
+
+    plan = SyncPlan([SyncAction('a_not_b', 'x', None, 'local', 'local')])
+    plan.append(SyncAction('b_not_a', 'y', None, 'local', 'local'))
+    assert '%s' % plan == '<SyncPlan(a_not_b=1, modified=0, b_not_a=1)>'
+    assert [x.finfo for x in plan.get_actions('b_not_a')] == ['y']
+
+    @raises(ValueError)
+    def test_tmp():
+        """ ... """
+        plan.append(SyncAction('delete', 'z', None, 'local', 'local'))
+
+    test_tmp()
+
+
+def test_sync_executor():
+    """ test SyncExecutor respects backend limits """
+    import time
+
+    running = {'gdrive': 0, 'local': 0}
+    peak = {'gdrive': 0, 'local': 0}
+    lock = threading.Lock()
+
+    def callback(backend):
+        """ track concurrently running callbacks per backend """
+        with lock:
+            running[backend] += 1
+            peak[backend] = max(peak[backend], running[backend])
+        time.sleep(0.01)
+        with lock:
+            running[backend] -= 1
+        return backend
+
+    actions = [
+        SyncAction('a_not_b', backend, None, backend, 'local')
+        for backend in ('gdrive', 'local') * 4
+    ]
+    executor = SyncExecutor({'a_not_b': callback}, max_workers=4)
+    assert executor.run(iter(actions)) == [x.finfo for x in actions]
+    assert peak['gdrive'] == 1
+    assert peak['local'] > 1
+
+    def failing(finfo):
+        """ ... """
+        raise RuntimeError(finfo)
+
+    executor = SyncExecutor({'a_not_b': failing, 'b_not_a': callback})
+    try:
+        executor.run([SyncAction('a_not_b', 'x', None, 'local', 'local')] + actions[1:2])
+        assert False
+    except RuntimeError as exc:
+        assert exc.args == ('x', )
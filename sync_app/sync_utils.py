@@ -7,12 +7,16 @@ from __future__ import (absolute_import, division, print_function, unicode_liter
 
 import os
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from apiclient.errors import HttpError
 
 from sync_app.file_cache import FileListCache
+from sync_app.file_cache_sqlite import FileListCacheSqlite
+from sync_app.file_cache_remote import FileListCacheRemote
 from sync_app.file_sync import FileSync
 from sync_app.gdrive_instance import TExecuteException
-from sync_app.util import MIMETYPE_SUFFIXES, GOOGLEAPP_MIMETYPES
+from sync_app.util import MIMETYPE_SUFFIXES, GOOGLEAPP_MIMETYPES, HASH_TYPES
 
 try:
     from apiclient.errors import UnknownFileType
@@ -26,6 +30,53 @@ except ImportError:
 LOCAL_DISKS = ('/home/ddboline', '/media/sabrent2000', '/media/caviar2000', '/media/western2000')
 LOCAL_DIRECTORIES = ('Documents/AudioBooks', 'Documents/mp3', 'Documents/podcasts',
                      'Documents/video', 'D0_Backup')
+LOCAL_CACHE_FILE = '%s/.local_file_list_cache.sqlite' % os.getenv('HOME')
+LOCAL_PICKLE_CACHE_FILE = '%s/.local_file_list_cache.pkl.gz' % os.getenv('HOME')
+GDRIVE_INDEX_FILE = '%s/.gdrive_index.pkl.gz' % os.getenv('HOME')
+REMOTE_CACHE_FILE = '%s/.remote_file_list_cache.sqlite' % os.getenv('HOME')
+
+
+def compare_and_cache(fsync, fcache, flists_local, **kwargs):
+    """
+        run FileSync.sync_lists, i.e. the callbacks run while the comparison goes on,
+        report lazy hashing, write digests computed during the comparison back to the local cache
+    """
+    fsync.sync_lists(**kwargs)
+    print('hashed %(hashed)s files, skipped %(skipped)s, ' % fsync.hash_stats +
+          'fingerprinted %(fingerprinted)s' % fsync.hash_stats)
+    if fsync.hash_stats['hashed'] > 0 or fsync.hash_stats['fingerprinted'] > 0:
+        print('write cache')
+        for flist in flists_local:
+            fcache.add_filelist_to_cache(flist)
+        fcache.write_cache_file_list()
+
+
+def get_remote_cache():
+    """ sqlite cache for box/onedrive metadata """
+    return FileListCacheRemote(sqlite_file=REMOTE_CACHE_FILE)
+
+
+def fill_remote_file_list(flist, cached=False, **kwargs):
+    """
+        fill remote flist from the remote metadata cache if cached and there are entries,
+        otherwise list it (the cache is revalidated and updated with the result)
+    """
+    remote_cache = get_remote_cache()
+    if cached and flist.load_cache(remote_cache):
+        return flist
+    flist.fill_file_list(remote_cache=remote_cache, **kwargs)
+    return flist
+
+
+def build_indexes(build_remote_index, directories, **kwargs):
+    """
+        build the remote index in the background while the local index (of directories) is built,
+        returns remote and local FileList
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(build_remote_index)
+        flist_local = build_local_index(directories=directories, **kwargs)
+        return future.result(), flist_local
 
 
 def build_onedrive_index(searchstr=None, verbose=True):
@@ -38,8 +89,7 @@ def build_onedrive_index(searchstr=None, verbose=True):
     #### always rebuild index
     if verbose:
         print('download file metadata')
-    flist.fill_file_list(searchstr=searchstr, verbose=verbose)
-    return flist
+    return fill_remote_file_list(flist, searchstr=searchstr, verbose=verbose)
 
 
 def build_box_index(searchstr=None, verbose=True):
@@ -52,21 +102,20 @@ def build_box_index(searchstr=None, verbose=True):
     #### always rebuild index
     if verbose:
         print('download file metadata')
-    flist.fill_file_list(searchstr=searchstr, verbose=verbose)
-    return flist
+    return fill_remote_file_list(flist, searchstr=searchstr, verbose=verbose)
 
 
-def build_gdrive_index(searchstr=None, verbose=True):
-    """ build GDrive index """
+def build_gdrive_index(searchstr=None, verbose=True, index_file=None, rebuild_index=False):
+    """ build GDrive index, incrementally from index_file if given """
     from sync_app.gdrive_instance import GdriveInstance
     from sync_app.file_list_gdrive import FileListGdrive
 
     gdrive = GdriveInstance()
     flist = FileListGdrive(gdrive=gdrive)
-    #### always rebuild index
     if verbose:
         print('download file metadata')
-    flist.fill_file_list(searchstr=searchstr, verbose=verbose)
+    flist.fill_file_list(
+        searchstr=searchstr, verbose=verbose, index_file=index_file, rebuild_index=rebuild_index)
     return flist
 
 
@@ -83,27 +132,77 @@ def build_s3_index():
     return flist
 
 
-def build_local_index(directories=None, rebuild_index=False):
-    """ build local index """
-    from sync_app.file_list_local import FileListLocal
-
-    if not directories:
-        return False
-    fcache = FileListCache(pickle_file='%s/.local_file_list_cache.pkl.gz' % os.getenv('HOME'))
-    flist_cache = None
-    if not rebuild_index:
-        flist_cache = fcache.get_cache_file_list(file_list_class=FileListLocal)
-    flist = FileListLocal(cache_file_list=flist_cache)
+def get_local_cache():
+    """ sqlite cache for local files, imported from the old pickle cache on first use """
+    from sync_app.file_info_local import FileInfoLocal
+
+    fcache = FileListCacheSqlite(sqlite_file=LOCAL_CACHE_FILE)
+    if not os.path.exists(LOCAL_CACHE_FILE) and os.path.exists(LOCAL_PICKLE_CACHE_FILE):
+        print('import %s' % LOCAL_PICKLE_CACHE_FILE)
+        pcache = FileListCache(pickle_file=LOCAL_PICKLE_CACHE_FILE)
+        fcache.write_cache_file_list(pcache.get_cache_file_list(file_info_class=FileInfoLocal))
+    return fcache
+
+
+def build_local_indexes(directory_lists,
+                        rebuild_index=False,
+                        hash_types=HASH_TYPES,
+                        fcache=None,
+                        paranoid=False):
+    """
+        build one local index per list of directories,
+        directories on different disks are scanned concurrently,
+        a single directory is the basedir of its list (relative paths for match_relpath)
+    """
+    from sync_app.file_list_local import FileListLocal, fill_file_lists
+
+    if fcache is None:
+        fcache = get_local_cache()
+    flists = []
+    flist_directories = []
+    for directories in directory_lists:
+        basedir = directories[0] if len(directories) == 1 else None
+        # an unmounted disk must not wipe its cache entries
+        directories = [direc for direc in directories if os.path.isdir(direc)]
+        flist = FileListLocal(
+            directory=basedir,
+            hash_types=hash_types,
+            file_cache=fcache,
+            load_cache=not rebuild_index,
+            paranoid=paranoid)
+        flists.append((flist, directories))
+        flist_directories.extend((flist, direc) for direc in directories)
     print('index local directories')
-    for direc in directories:
+    for _, direc in flist_directories:
         print('directory', direc)
-        flist.fill_file_list(directory=direc)
+    fill_file_lists(flist_directories)
     print('write cache')
-    fcache.write_cache_file_list(flist)
-    return flist
+    for flist, directories in flists:
+        fcache.write_cache_file_list(flist, directory=directories)
+    return [flist for flist, _ in flists]
+
+
+def build_local_index(directories=None,
+                      rebuild_index=False,
+                      hash_types=HASH_TYPES,
+                      fcache=None,
+                      paranoid=False):
+    """
+        build local index, digests are computed lazily (hash_types at a time),
+        only the cache entries below directories are loaded,
+        pass fcache to write digests computed later back to the same cache,
+        directories with unchanged mtime aren't re-listed unless paranoid
+    """
+    if not directories:
+        return False
+    return build_local_indexes([directories],
+                               rebuild_index=rebuild_index,
+                               hash_types=hash_types,
+                               fcache=fcache,
+                               paranoid=paranoid)[0]
 
 
-def sync_gdrive(dry_run=False, delete_file=None, rebuild_index=False):
+def sync_gdrive(dry_run=False, delete_file=None, rebuild_index=False, paranoid=False):
     """ build gdrive index """
     if delete_file:
         for df_ in delete_file:
@@ -112,10 +211,15 @@ def sync_gdrive(dry_run=False, delete_file=None, rebuild_index=False):
                 os.remove(df_)
 
     from sync_app.file_list_gdrive import BASE_DIR as BASE_DIR_GDRIVE
-    print('build gdrive')
-    flist_gdrive = build_gdrive_index()
-    print('build local gdrive')
-    flist_local = build_local_index(directories=[BASE_DIR_GDRIVE], rebuild_index=rebuild_index)
+    print('build gdrive and local gdrive')
+    fcache = get_local_cache()
+    flist_gdrive, flist_local = build_indexes(
+        partial(build_gdrive_index, index_file=GDRIVE_INDEX_FILE, rebuild_index=rebuild_index),
+        [BASE_DIR_GDRIVE],
+        rebuild_index=rebuild_index,
+        paranoid=paranoid,
+        hash_types=('md5', ),
+        fcache=fcache)
     fsync = FileSync(flists=[flist_gdrive, flist_local])
 
     def upload_file(finfo):
@@ -199,10 +303,16 @@ def sync_gdrive(dry_run=False, delete_file=None, rebuild_index=False):
                     return False
         return
 
-    fsync.compare_lists(callback0=download_file, callback1=upload_file)
+    compare_and_cache(
+        fsync,
+        fcache,
+        [flist_local],
+        callback0=download_file,
+        callback1=upload_file,
+        match_relpath=True)
 
 
-def sync_onedrive(dry_run=False, delete_file=None, rebuild_index=False):
+def sync_onedrive(dry_run=False, delete_file=None, rebuild_index=False, paranoid=False):
     """ build onedrive index """
     if delete_file:
         for df_ in delete_file:
@@ -211,10 +321,15 @@ def sync_onedrive(dry_run=False, delete_file=None, rebuild_index=False):
                 os.remove(df_)
 
     from sync_app.file_list_onedrive import BASE_DIR as BASE_DIR_ONEDRIVE
-    print('build onedrive')
-    flist_onedrive = build_onedrive_index()
-    print('build local onedrive')
-    flist_local = build_local_index(directories=[BASE_DIR_ONEDRIVE], rebuild_index=rebuild_index)
+    print('build onedrive and local onedrive')
+    fcache = get_local_cache()
+    flist_onedrive, flist_local = build_indexes(
+        build_onedrive_index,
+        [BASE_DIR_ONEDRIVE],
+        rebuild_index=rebuild_index,
+        paranoid=paranoid,
+        hash_types=('sha1', ),
+        fcache=fcache)
     fsync = FileSync(flists=[flist_onedrive, flist_local])
 
     def upload_file(finfo):
@@ -239,10 +354,17 @@ def sync_onedrive(dry_run=False, delete_file=None, rebuild_index=False):
                 return finfo.download()
         return
 
-    fsync.compare_lists(callback0=download_file, callback1=upload_file, use_sha1=True)
+    compare_and_cache(
+        fsync,
+        fcache,
+        [flist_local],
+        callback0=download_file,
+        callback1=upload_file,
+        use_sha1=True,
+        match_relpath=True)
 
 
-def sync_box(dry_run=False, delete_file=None, rebuild_index=False):
+def sync_box(dry_run=False, delete_file=None, rebuild_index=False, paranoid=False):
     """ build box index """
     if delete_file:
         for df_ in delete_file:
@@ -251,10 +373,15 @@ def sync_box(dry_run=False, delete_file=None, rebuild_index=False):
                 os.remove(df_)
 
     from sync_app.file_list_box import BASE_DIR as BASE_DIR_BOX
-    print('build box')
-    flist_box = build_box_index()
-    print('build local box')
-    flist_local = build_local_index(directories=[BASE_DIR_BOX], rebuild_index=rebuild_index)
+    print('build box and local box')
+    fcache = get_local_cache()
+    flist_box, flist_local = build_indexes(
+        build_box_index,
+        [BASE_DIR_BOX],
+        rebuild_index=rebuild_index,
+        paranoid=paranoid,
+        hash_types=('sha1', ),
+        fcache=fcache)
     fsync = FileSync(flists=[flist_box, flist_local])
 
     def upload_file(finfo):
@@ -279,10 +406,17 @@ def sync_box(dry_run=False, delete_file=None, rebuild_index=False):
                 return finfo.download()
         return
 
-    fsync.compare_lists(callback0=download_file, callback1=upload_file, use_sha1=True)
+    compare_and_cache(
+        fsync,
+        fcache,
+        [flist_local],
+        callback0=download_file,
+        callback1=upload_file,
+        use_sha1=True,
+        match_relpath=True)
 
 
-def sync_s3(dry_run=False, delete_file=None, rebuild_index=False):
+def sync_s3(dry_run=False, delete_file=None, rebuild_index=False, paranoid=False):
     """ sync with s3 """
     if delete_file:
         for df_ in delete_file:
@@ -296,7 +430,13 @@ def sync_s3(dry_run=False, delete_file=None, rebuild_index=False):
     print('build s3')
     flist_s3 = build_s3_index()
     print('build local s3')
-    flist_local = build_local_index(directories=[BASE_DIR_S3], rebuild_index=rebuild_index)
+    fcache = get_local_cache()
+    flist_local = build_local_index(
+        directories=[BASE_DIR_S3],
+        rebuild_index=rebuild_index,
+        paranoid=paranoid,
+        hash_types=('md5', ),
+        fcache=fcache)
     fsync = FileSync(flists=[flist_s3, flist_local])
 
     def upload_file(finfo):
@@ -327,10 +467,10 @@ def sync_s3(dry_run=False, delete_file=None, rebuild_index=False):
             if not dry_run:
                 flist_s3.s3_.download(bn_, kn_, fn_)
 
-    fsync.compare_lists(callback0=download_file, callback1=upload_file)
+    compare_and_cache(fsync, fcache, [flist_local], callback0=download_file, callback1=upload_file)
 
 
-def sync_local(dry_run=False, delete_file=None, rebuild_index=False):
+def sync_local(dry_run=False, delete_file=None, rebuild_index=False, paranoid=False):
     """ sync local directories """
     if delete_file:
         for df_ in delete_file:
@@ -339,15 +479,18 @@ def sync_local(dry_run=False, delete_file=None, rebuild_index=False):
                 if not dry_run:
                     os.remove(df_)
 
+    fcache = get_local_cache()
+
     def sync_local_directories(ldirectories, ldisks):
         """ sync two local directories """
         for directory in ldirectories:
-            flists_local = []
-            for disk in ldisks:
-                ldir = '/'.join([disk, directory])
-                print('build local %s' % ldir)
-                flists_local.append(
-                    build_local_index(directories=[ldir], rebuild_index=rebuild_index))
+            print('build local %s' % directory)
+            flists_local = build_local_indexes(
+                [['/'.join([disk, directory])] for disk in ldisks],
+                rebuild_index=rebuild_index,
+                paranoid=paranoid,
+                hash_types=('md5', ),
+                fcache=fcache)
 
             def copy_file0(finfo):
                 """ callback """
@@ -359,8 +502,14 @@ def sync_local(dry_run=False, delete_file=None, rebuild_index=False):
                 for disk in ldisks:
                     print('copy1', finfo.filename, disk, directory)
 
-            fsync = FileSync(flists=[flists_local])
-            fsync.compare_lists(callback0=copy_file0, callback1=copy_file1)
+            fsync = FileSync(flists=flists_local)
+            compare_and_cache(
+                fsync,
+                fcache,
+                flists_local,
+                callback0=copy_file0,
+                callback1=copy_file1,
+                match_relpath=True)
 
     sync_local_directories(LOCAL_DIRECTORIES, LOCAL_DISKS)
     sync_local_directories(('dilepton2_backup', 'dilepton_tower_backup'),
@@ -370,10 +519,15 @@ def sync_local(dry_run=False, delete_file=None, rebuild_index=False):
 def sync_arg_parse():
     """ parse args """
     commands = ('all', 'gdrive', 'onedrive', 's3', 'box', 'local', 'dry_run', 'delete')
-    help_text = 'usage: ./sync.py <%s> [rebuild]' % '|'.join(commands)
+    help_text = 'usage: ./sync.py <%s> [rebuild] [--paranoid]' % '|'.join(commands)
     parser = argparse.ArgumentParser(description='sync app')
     parser.add_argument('command', nargs='*', help=help_text)
+    parser.add_argument(
+        '--paranoid',
+        action='store_true',
+        help='list and stat every file even in directories whose mtime is unchanged')
     args = parser.parse_args()
+    do_paranoid = args.paranoid
 
     do_local, do_gdrive, do_onedrive, do_s3, do_box, do_dry_run, do_rebuild = \
         7*[False]
@@ -404,15 +558,35 @@ def sync_arg_parse():
                 delete_f.append(temp_)
 
     if do_s3:
-        sync_s3(dry_run=do_dry_run, delete_file=delete_f, rebuild_index=do_rebuild)
+        sync_s3(
+            dry_run=do_dry_run,
+            delete_file=delete_f,
+            rebuild_index=do_rebuild,
+            paranoid=do_paranoid)
     if do_gdrive:
-        sync_gdrive(dry_run=do_dry_run, delete_file=delete_f, rebuild_index=do_rebuild)
+        sync_gdrive(
+            dry_run=do_dry_run,
+            delete_file=delete_f,
+            rebuild_index=do_rebuild,
+            paranoid=do_paranoid)
     if do_onedrive:
-        sync_onedrive(dry_run=do_dry_run, delete_file=delete_f, rebuild_index=do_rebuild)
+        sync_onedrive(
+            dry_run=do_dry_run,
+            delete_file=delete_f,
+            rebuild_index=do_rebuild,
+            paranoid=do_paranoid)
     if do_box:
-        sync_box(dry_run=do_dry_run, delete_file=delete_f, rebuild_index=do_rebuild)
+        sync_box(
+            dry_run=do_dry_run,
+            delete_file=delete_f,
+            rebuild_index=do_rebuild,
+            paranoid=do_paranoid)
     if do_local:
-        sync_local(dry_run=do_dry_run, delete_file=delete_f, rebuild_index=do_rebuild)
+        sync_local(
+            dry_run=do_dry_run,
+            delete_file=delete_f,
+            rebuild_index=do_rebuild,
+            paranoid=do_paranoid)
 
     return
 
@@ -424,13 +598,16 @@ def list_drive_parse():
     search_strings = []
     parent_directory = None
     number_to_list = -1
+    use_cache = False
 
     for arg in os.sys.argv:
         if 'list_drive_files' in arg:
             continue
+        elif arg == 'cached':
+            use_cache = True
         elif arg in ['h', '--help', '-h']:
             print('list_drive_files <' + '|'.join(commands) +
-                  '> <file/key> directory=<id of directory>')
+                  '> <file/key> directory=<id of directory> [cached]')
             exit(0)
         elif arg in commands:
             cmd = arg
@@ -453,13 +630,17 @@ def list_drive_parse():
     flist_gdrive = FileListGdrive(gdrive=gdrive)
 
     if cmd == 'list':
-        flist_gdrive.fill_file_list(verbose=False, number_to_process=number_to_list)
-        for key, val in flist_gdrive.filelist_id_dict.items():
-            if parent_directory \
-                    and parent_directory not in os.path.dirname(val.filename):
-                continue
+        from sync_app.file_info_gdrive import BASE_DIR as BASE_DIR_GDRIVE
+        if not use_cache or not flist_gdrive.load_index(GDRIVE_INDEX_FILE):
+            flist_gdrive.fill_file_list(
+                verbose=False, number_to_process=number_to_list, index_file=GDRIVE_INDEX_FILE)
+        if parent_directory:
+            finfos = flist_gdrive.get_files_under(os.path.join(BASE_DIR_GDRIVE, parent_directory))
+        else:
+            finfos = flist_gdrive.filelist_id_dict.values()
+        for val in finfos:
             if val.md5sum:
-                print('key filename', key, val.filename)
+                print('key filename', val.gdriveid, val.filename)
     elif cmd == 'search':
         if search_strings:
             for search_string in search_strings:
@@ -561,13 +742,16 @@ def list_onedrive_parse():
     search_strings = []
     parent_directory = None
     number_to_list = -1
+    use_cache = False
 
     for arg in os.sys.argv:
         if 'list_onedrive_files' in arg:
             continue
+        elif arg == 'cached':
+            use_cache = True
         elif arg in ['h', '--help', '-h']:
             print('list_onedrive_files <' + '|'.join(commands) +
-                  '> <file/key> directory=<id of directory>')
+                  '> <file/key> directory=<id of directory> [cached]')
             exit(0)
         elif arg in commands:
             cmd = arg
@@ -590,7 +774,8 @@ def list_onedrive_parse():
     flist_onedrive = FileListOneDrive(onedrive=onedrive)
 
     if cmd == 'list':
-        flist_onedrive.fill_file_list(verbose=False, number_to_process=number_to_list)
+        fill_remote_file_list(
+            flist_onedrive, cached=use_cache, verbose=False, number_to_process=number_to_list)
         for key, val in flist_onedrive.filelist_id_dict.items():
             if parent_directory \
                     and parent_directory not in os.path.dirname(val.filename):
@@ -598,7 +783,7 @@ def list_onedrive_parse():
             if val.sha1sum:
                 print('key val', key, val)
     elif cmd == 'search':
-        flist_onedrive.fill_file_list(verbose=False)
+        fill_remote_file_list(flist_onedrive, cached=use_cache, verbose=False)
         if search_strings:
             for search_string in search_strings:
                 for key, val in flist_onedrive.filelist_id_dict.items():
@@ -639,13 +824,16 @@ def list_box_parse():
     search_strings = []
     parent_directory = None
     number_to_list = -1
+    use_cache = False
 
     for arg in os.sys.argv:
         if 'list_box_files' in arg:
             continue
+        elif arg == 'cached':
+            use_cache = True
         elif arg in ['h', '--help', '-h']:
             print('list_box_files <' + '|'.join(commands) +
-                  '> <file/key> directory=<id of directory>')
+                  '> <file/key> directory=<id of directory> [cached]')
             exit(0)
         elif arg in commands:
             cmd = arg
@@ -668,7 +856,8 @@ def list_box_parse():
     flist_box = FileListBox(box=box)
 
     if cmd == 'list':
-        flist_box.fill_file_list(verbose=False, number_to_process=number_to_list)
+        fill_remote_file_list(
+            flist_box, cached=use_cache, verbose=False, number_to_process=number_to_list)
         for key, val in flist_box.filelist_id_dict.items():
             if parent_directory \
                     and parent_directory not in os.path.dirname(val.filename):
@@ -676,7 +865,7 @@ def list_box_parse():
             if val.sha1sum:
                 print('key val list', key, val)
     elif cmd == 'search':
-        flist_box.fill_file_list(verbose=False)
+        fill_remote_file_list(flist_box, cached=use_cache, verbose=False)
         if search_strings:
             for search_string in search_strings:
                 for key, val in flist_box.filelist_id_dict.items():
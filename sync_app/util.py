@@ -5,6 +5,8 @@ from __future__ import (absolute_import, division, print_function, unicode_liter
 
 import os
 import hashlib
+from binascii import hexlify, unhexlify
+from collections import namedtuple
 from subprocess import call, Popen, PIPE
 
 import requests
@@ -13,8 +15,20 @@ try:
 except AttributeError:
     pass
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
 HOMEDIR = os.getenv('HOME')
 
+HASH_TYPES = ('md5', 'sha1')
+HASH_CHUNKSIZE = 4 * 1024 * 1024
+FINGERPRINT_SIZE = 64 * 1024
+
 GOOGLEAPP_MIMETYPES = {
     'application/vnd.google-apps.document':
     'application/vnd.oasis.opendocument.text',
@@ -26,6 +40,8 @@ GOOGLEAPP_MIMETYPES = {
     'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
 }
 
+ScanEntry = namedtuple('ScanEntry', ['path', 'st_size', 'st_mtime', 'st_ino', 'st_dev'])
+
 MIMETYPE_SUFFIXES = {
     'application/vnd.oasis.opendocument.text': 'odt',
     'image/png': 'png',
@@ -82,13 +98,70 @@ def cleanup_path(orig_path):
     return orig_path
 
 
-def walk_wrapper(direc, callback, arg):
-    """ wrapper around os.walk for py2/py3 compatibility """
-    if hasattr(os.path, 'walk'):
-        os.path.walk(direc, callback, arg)
-    elif hasattr(os, 'walk'):
-        for dirpath, dirnames, filenames in os.walk(direc):
-            callback(arg, dirpath, dirnames + filenames)
+def scan_directory(direc):
+    """
+        list direc in one pass, return ([ScanEntry for each file], [names of subdirectories]),
+        the entry type comes from the directory listing and each file is stat'ed once,
+        symlinked directories aren't followed (like os.walk)
+    """
+    files, subdirs = [], []
+    if scandir is None:
+        for fn_ in os.listdir(direc):
+            path = os.path.join(direc, fn_)
+            if os.path.isdir(path) and not os.path.islink(path):
+                subdirs.append(fn_)
+            elif os.path.isfile(path):
+                st_ = os.stat(path)
+                files.append(ScanEntry(path, st_.st_size, st_.st_mtime, st_.st_ino, st_.st_dev))
+    else:
+        for entry in scandir(direc):
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.is_file():
+                    st_ = entry.stat()
+                    files.append(
+                        ScanEntry(entry.path, st_.st_size, st_.st_mtime, st_.st_ino, st_.st_dev))
+            except OSError:
+                continue
+    files.sort()
+    subdirs.sort()
+    return files, subdirs
+
+
+# every directory name in use, so paths which share a directory share one string
+DIRECTORY_NAMES = {}
+
+
+def split_path(path):
+    """ (directory including the trailing '/', basename), joined again by + """
+    idx = path.rfind('/') + 1
+    return path[:idx], path[idx:]
+
+
+def intern_directory(dname):
+    """ the one shared copy of directory name dname """
+    return DIRECTORY_NAMES.setdefault(dname, dname)
+
+
+def to_digest(val):
+    """
+        raw bytes of a hex md5/sha1 digest, anything else
+        (raw digests, pending results, multipart etags, empty values) is returned unchanged
+    """
+    if isinstance(val, (str, type(''))) and len(val) in (32, 40):
+        try:
+            return unhexlify(val)
+        except (TypeError, ValueError):
+            return val
+    return val
+
+
+def to_hex(val):
+    """ hex string of a raw md5/sha1 digest, anything else is returned unchanged """
+    if isinstance(val, bytes) and len(val) in (16, 20):
+        return hexlify(val).decode()
+    return val
 
 
 def get_md5_old(fname):
@@ -100,14 +173,54 @@ def get_md5_old(fname):
     return md_.hexdigest()
 
 
+def get_hashes(fname, hash_types=HASH_TYPES, chunksize=HASH_CHUNKSIZE):
+    """
+        read fname once in large chunks, feed every requested hashlib object,
+        return tuple of hexdigests in the order of hash_types
+    """
+    hashes = [hashlib.new(htype) for htype in hash_types]
+    buf = bytearray(chunksize)
+    view = memoryview(buf)
+    with open(fname, 'rb', buffering=0) as infile:
+        while True:
+            nbytes = infile.readinto(buf)
+            if not nbytes:
+                break
+            for hash_ in hashes:
+                hash_.update(view[:nbytes])
+    return tuple(hash_.hexdigest() for hash_ in hashes)
+
+
+def get_hashes_batch(fnames, hash_types=HASH_TYPES):
+    """ hash a list of files in one call, empty digests for unreadable files """
+    output = []
+    for fname in fnames:
+        try:
+            output.append(get_hashes(fname, hash_types))
+        except (IOError, OSError):
+            output.append(tuple('' for _ in hash_types))
+    return output
+
+
+def get_fingerprint(fname, nbytes=FINGERPRINT_SIZE):
+    """
+        cheap partial-content hash: md5 of size, first nbytes and last nbytes,
+        different fingerprints mean different files, equal ones prove nothing
+    """
+    md_ = hashlib.md5()
+    with open(fname, 'rb') as infile:
+        size = os.fstat(infile.fileno()).st_size
+        md_.update(('%d:' % size).encode())
+        md_.update(infile.read(nbytes))
+        if size > nbytes:
+            infile.seek(max(nbytes, size - nbytes))
+            md_.update(infile.read(nbytes))
+    return md_.hexdigest()
+
+
 def get_md5(fname):
-    """ system md5 function """
-    try:
-        with run_command('md5sum "%s" 2> /dev/null' % cleanup_path(fname), do_popen=True) as pop_:
-            output = pop_.stdout.read().split()[0]
-        return output.decode()
-    except IndexError:
-        return get_md5_old(fname)
+    """ md5 function """
+    return get_hashes(fname, hash_types=('md5', ))[0]
 
 
 def get_filetype(fname):
@@ -135,13 +248,8 @@ def get_sha1_old(fname):
 
 
 def get_sha1(fname):
-    """ system sha1 function """
-    try:
-        with run_command('sha1sum "%s" 2> /dev/null' % cleanup_path(fname), do_popen=True) as pop_:
-            output = pop_.stdout.read().split()[0]
-        return output.decode()
-    except IndexError:
-        return get_sha1_old(fname)
+    """ sha1 function """
+    return get_hashes(fname, hash_types=('sha1', ))[0]
 
 
 def get_random_hex_string(nbytes):
@@ -165,6 +273,58 @@ def test_get_sha1():
     assert tmp == test
 
 
+def test_get_hashes():
+    """ test get_hashes """
+    fn_ = 'tests/test_dir/hello_world.txt'
+    test = ('8ddd8be4b179a529afa5f2ffae4b9858', 'a0b65939670bc2c010f4d5d6a0b3e4e4590fb92b')
+    assert get_hashes(fn_) == test
+    assert get_hashes(fn_, chunksize=3) == test
+    assert get_hashes(fn_, hash_types=('sha1', )) == test[1:]
+    assert get_hashes_batch([fn_, 'apsodfij']) == [test, ('', '')]
+
+
+def test_get_fingerprint():
+    """ test get_fingerprint """
+    fn_ = 'tests/test_dir/hello_world.txt'
+    tmp = get_fingerprint(fn_)
+    assert tmp == hashlib.md5(b'13:' + open(fn_, 'rb').read()).hexdigest()
+    assert get_fingerprint(fn_, nbytes=4) != tmp
+    assert get_fingerprint(fn_, nbytes=4) == get_fingerprint(fn_, nbytes=4)
+
+
+def test_scan_directory():
+    """ test scan_directory """
+    entries, subdirs = scan_directory('tests/test_dir')
+    entries = sorted(entries)
+    assert [os.path.relpath(x.path) for x in entries] == [
+        'tests/test_dir/goodbye_world.txt', 'tests/test_dir/hello_world.txt'
+    ]
+    assert subdirs == ['test_subdir']
+    st_ = os.stat('tests/test_dir/hello_world.txt')
+    assert entries[1][1:] == (st_.st_size, st_.st_mtime, st_.st_ino, st_.st_dev)
+
+
+def test_split_path():
+    """ test split_path, intern_directory """
+    for path, expected in (('/a/b/x.txt', ('/a/b/', 'x.txt')), ('x.txt', ('', 'x.txt')),
+                           ('/x.txt', ('/', 'x.txt')), ('/a//b', ('/a//', 'b'))):
+        assert split_path(path) == expected
+        assert ''.join(split_path(path)) == path
+    dname = split_path('/a/b/x.txt')[0]
+    assert intern_directory(split_path('/a/b/y.txt')[0]) is intern_directory(dname)
+
+
+def test_to_digest():
+    """ test to_digest, to_hex """
+    md5 = '8ddd8be4b179a529afa5f2ffae4b9858'
+    assert len(to_digest(md5)) == 16
+    assert to_hex(to_digest(md5)) == md5
+    assert to_digest(to_digest(md5)) == to_digest(md5)
+    for val in ('', 'd41d8cd98f00b204e9800998ecf8427e-2', 'x' * 32, None):
+        assert to_digest(val) == val
+        assert to_hex(val) == val
+
+
 def test_run_command():
     """ test run_command """
     cmd = 'echo "HELLO"'
@@ -0,0 +1,175 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+    In memory stand-in for the Google Drive v3 service,
+    enough of files() and changes() for GdriveInstance(service=FakeDriveService(...))
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import re
+from collections import defaultdict
+
+from sync_app.gdrive_instance import TExecuteException, InvalidPageToken
+
+FOLDER_MIMETYPE = 'application/vnd.google-apps.folder'
+
+
+def match_modified_time(q, item):
+    """ does item match the modifiedTime < / >= "..." clauses of q """
+    for oper, value in re.findall(r'modifiedTime (<|>=) "([^"]*)"', q):
+        if (item['modifiedTime'] < value) != (oper == '<'):
+            return False
+    return True
+
+
+class FakeRequest(object):
+    """ request object, the call happens on execute """
+
+    def __init__(self, func, **kwargs):
+        self.func = func
+        self.kwargs = kwargs
+
+    def execute(self):
+        """ ... """
+        return self.func(**self.kwargs)
+
+
+class FakeFiles(object):
+    """ service.files() """
+
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, q='', fields=None, pageToken=None, pageSize=None):
+        """ files.list, folders or non-folders depending on q """
+        return FakeRequest(self.service.list_files, q=q, page_token=pageToken)
+
+    def get(self, fileId, fields=None):
+        """ files.get """
+        return FakeRequest(self.service.get_file, fid=fileId)
+
+
+class FakeBatch(object):
+    """ batch request, callback(request_id, response, exception) for each request """
+
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        """ ... """
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        """ ... """
+        self.service.calls['batch'] += 1
+        for request_id, request in self.requests:
+            try:
+                response, exception = request.execute(), None
+            except TExecuteException as exc:
+                response, exception = None, exc
+            self.callback(request_id, response, exception)
+
+
+class FakeChanges(object):
+    """ service.changes() """
+
+    def __init__(self, service):
+        self.service = service
+
+    def getStartPageToken(self):
+        """ changes.getStartPageToken """
+        return FakeRequest(lambda: {'startPageToken': '%s' % len(self.service.log)})
+
+    def list(self, pageToken, pageSize=None, spaces=None, fields=None):
+        """ changes.list """
+        return FakeRequest(self.service.list_changes, page_token=pageToken)
+
+
+class FakeDriveService(object):
+    """
+        drive holding items (dicts as returned by the api), every update/remove is logged,
+        page tokens are positions in the log, expire invalidates every token handed out so far,
+        errors[fid or 'changes.list'] is the number of upcoming calls which fail
+    """
+
+    def __init__(self, items, page_size=2):
+        self.items = dict((item['id'], item) for item in items)
+        self.page_size = page_size
+        self.log = []
+        self.oldest_token = 0
+        self.calls = defaultdict(int)
+        self.errors = defaultdict(int)
+
+    def files(self):
+        return FakeFiles(self)
+
+    def changes(self):
+        return FakeChanges(self)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    def update(self, item):
+        """ add or modify item """
+        self.items[item['id']] = item
+        self.log.append(item['id'])
+
+    def remove(self, fid):
+        """ delete item """
+        self.items.pop(fid)
+        self.log.append(fid)
+
+    def expire(self):
+        """ invalidate all page tokens """
+        self.oldest_token = len(self.log)
+
+    def list_files(self, q, page_token=None):
+        self.calls['files.list'] += 1
+        is_folder = '!=' not in q
+        # like the real drive, the root folder itself isn't listed
+        fids = sorted(fid for fid, item in self.items.items()
+                      if (item['mimeType'] == FOLDER_MIMETYPE) == is_folder and item.get('parents')
+                      and match_modified_time(q, item))
+        start = int(page_token or 0)
+        response = {'files': [self.items[fid] for fid in fids[start:start + self.page_size]]}
+        if start + self.page_size < len(fids):
+            response['nextPageToken'] = '%s' % (start + self.page_size)
+        return response
+
+    def fail(self, key):
+        """ raise a transient (5xx) error if there are errors left for key """
+        if self.errors[key] > 0:
+            self.errors[key] -= 1
+            raise TExecuteException('Backend Error')
+
+    def get_file(self, fid):
+        self.calls['files.get'] += 1
+        self.fail(fid)
+        if fid not in self.items:
+            # what t_execute raises for the 404 of a missing or unshared file
+            raise TExecuteException('File not found: %s' % fid)
+        return self.items[fid]
+
+    def list_changes(self, page_token):
+        self.calls['changes.list'] += 1
+        self.fail('changes.list')
+        start = int(page_token)
+        if start < self.oldest_token:
+            raise InvalidPageToken('Invalid Value')
+        changes = []
+        for fid in self.log[start:start + self.page_size]:
+            if fid in self.items:
+                changes.append({'fileId': fid, 'removed': False, 'file': self.items[fid]})
+            else:
+                changes.append({'fileId': fid, 'removed': True})
+        response = {'changes': changes}
+        if start + self.page_size < len(self.log):
+            response['nextPageToken'] = '%s' % (start + self.page_size)
+        else:
+            response['newStartPageToken'] = '%s' % len(self.log)
+        return response
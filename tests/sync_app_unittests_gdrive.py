@@ -11,6 +11,7 @@ from __future__ import unicode_literals
 import os
 import hashlib
 import shutil
+import tempfile
 import unittest
 
 CURDIR = os.path.abspath(os.curdir)
@@ -18,7 +19,9 @@ os.sys.path.append(CURDIR)
 
 from sync_app.util import get_md5, get_random_hex_string
 from sync_app.file_list_gdrive import FileListGdrive
-from sync_app.gdrive_instance import GdriveInstance
+from sync_app.file_info_gdrive import BASE_DIR
+from sync_app.gdrive_instance import GdriveInstance, modified_time_shards
+from tests.gdrive_fake_service import FakeDriveService, FOLDER_MIMETYPE
 
 TEST_FILE = 'tests/test_dir/hello_world.txt'
 TEST_DIR = 'tests/test_dir'
@@ -27,6 +30,24 @@ TEST_GDR = 'Amazon-Gift-Card.pdf'
 HOMEDIR = os.getenv('HOME')
 
 
+def get_fake_item(fid, name, parent=None, mimetype='text/plain'):
+    """ item as returned by files.list/files.get """
+    item = {
+        'id': fid,
+        'name': name,
+        'mimeType': mimetype,
+        'modifiedTime': '2016-01-01T00:00:00.000Z',
+        'owners': [{
+            'me': True
+        }]
+    }
+    if parent:
+        item['parents'] = [parent]
+    if mimetype != FOLDER_MIMETYPE:
+        item.update({'md5Checksum': '%032x' % len(name), 'size': '10', 'fileExtension': 'txt'})
+    return item
+
+
 class TestSyncAppGdrive(unittest.TestCase):
     """ SyncApp Unit Tests """
 
@@ -109,5 +130,125 @@ class TestSyncAppGdrive(unittest.TestCase):
         self.assertEqual('test_directory', flist_gdrive.filelist_id_dict[fid].filename)
 
 
+class TestSyncAppGdriveIncremental(unittest.TestCase):
+    """ FileListGdrive incremental listing against FakeDriveService """
+
+    def setUp(self):
+        self.service = FakeDriveService([
+            get_fake_item('root', 'My Drive', mimetype=FOLDER_MIMETYPE),
+            get_fake_item('docs', 'docs', 'root', mimetype=FOLDER_MIMETYPE),
+            get_fake_item('a', 'a.txt', 'root'),
+            get_fake_item('b', 'b.txt', 'docs'),
+            get_fake_item('c', 'c.txt', 'docs'),
+        ])
+        self.gdrive = GdriveInstance(service=self.service)
+        self.tmpdir = tempfile.mkdtemp()
+        self.index_file = '%s/gdrive_index.pkl.gz' % self.tmpdir
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def get_filenames(self):
+        """ fill a new FileListGdrive from self.index_file """
+        flist_gdrive = FileListGdrive(gdrive=self.gdrive)
+        flist_gdrive.fill_file_list(verbose=False, index_file=self.index_file)
+        return sorted(os.path.relpath(fn_, BASE_DIR) for fn_ in flist_gdrive.filelist)
+
+    def test_gdrive_changes(self):
+        """ Test FileListGdrive.fill_file_list_incremental """
+        self.assertEqual(self.get_filenames(), ['a.txt', 'docs/b.txt', 'docs/c.txt'])
+        # one page of folders, two of files, the (unlisted) root folder fetched in a batch
+        self.assertEqual(self.service.calls['files.list'], 3)
+        self.assertEqual(self.service.calls['files.get'], 1)
+        self.assertEqual(self.service.calls['batch'], 1)
+
+        self.service.update(get_fake_item('b', 'd.txt', 'root'))
+        self.service.update(get_fake_item('docs', 'documents', 'root', mimetype=FOLDER_MIMETYPE))
+        self.service.remove('a')
+        self.assertEqual(self.get_filenames(), ['d.txt', 'documents/c.txt'])
+        self.assertEqual(self.service.calls['files.list'], 3)
+        self.assertEqual(self.service.calls['files.get'], 1)
+        self.assertEqual(self.service.calls['batch'], 1)
+        self.assertEqual(self.service.calls['changes.list'], 2)
+
+        self.assertEqual(self.get_filenames(), ['d.txt', 'documents/c.txt'])
+        self.assertEqual(self.service.calls['changes.list'], 3)
+
+    def test_gdrive_orphans(self):
+        """ Test items whose parent can't be fetched are skipped """
+        self.service.update(get_fake_item('o', 'orphan.txt', 'gone'))
+        self.service.update(get_fake_item('x', 'x', 'gone', mimetype=FOLDER_MIMETYPE))
+        self.service.update(get_fake_item('y', 'y.txt', 'x'))
+        self.assertEqual(self.get_filenames(), ['a.txt', 'docs/b.txt', 'docs/c.txt'])
+        # 'gone' is fetched once, in the batch along with the root folder
+        self.assertEqual(self.service.calls['files.get'], 2)
+
+    def test_gdrive_transient_errors(self):
+        """ Test items and changes which fail to resolve are kept and retried next time """
+        self.service.errors['root'] = 10
+        self.assertEqual(self.get_filenames(), [])
+        self.service.errors.clear()
+        self.assertEqual(self.get_filenames(), ['a.txt', 'docs/b.txt', 'docs/c.txt'])
+
+        self.service.update(get_fake_item('e', 'e.txt', 'docs'))
+        self.service.errors['changes.list'] = 1
+        self.assertEqual(self.get_filenames(), ['a.txt', 'docs/b.txt', 'docs/c.txt'])
+        self.assertEqual(self.get_filenames(),
+                         ['a.txt', 'docs/b.txt', 'docs/c.txt', 'docs/e.txt'])
+        # no fall back to a full listing
+        self.assertEqual(self.service.calls['files.list'], 3)
+
+    def test_gdrive_changes_expired(self):
+        """ Test FileListGdrive.fill_file_list_incremental falls back to a full listing """
+        self.get_filenames()
+        self.service.update(get_fake_item('e', 'e.txt', 'docs'))
+        self.service.expire()
+        self.assertEqual(self.get_filenames(),
+                         ['a.txt', 'docs/b.txt', 'docs/c.txt', 'docs/e.txt'])
+        self.assertEqual(self.service.calls['files.list'], 6)
+
+    def test_gdrive_list_shards(self):
+        """ Test GdriveInstance.list_files split into concurrent shards """
+        for idx in range(7):
+            item = get_fake_item('s%d' % idx, 's%d.txt' % idx, 'root')
+            item['modifiedTime'] = '%d-06-01T00:00:00.000Z' % (2010 + idx)
+            self.service.update(item)
+        shards = modified_time_shards(['2012-01-01', '2014-01-01'])
+        self.assertEqual(shards, [
+            'modifiedTime < "2012-01-01"',
+            'modifiedTime >= "2012-01-01" and modifiedTime < "2014-01-01"',
+            'modifiedTime >= "2014-01-01"'
+        ])
+        items = []
+        self.gdrive.list_files(items.append, shards=shards)
+        self.assertEqual(sorted(item['id'] for item in items),
+                         ['a', 'b', 'c'] + ['s%d' % idx for idx in range(7)])
+        # 1 + 1 + 3 pages of at most 2 files
+        self.assertEqual(self.service.calls['files.list'], 5)
+
+        items = []
+        self.gdrive.number_to_process = 2
+        self.gdrive.items_processed = 0
+        self.gdrive.list_files(items.append)
+        self.assertEqual(len(items), 3)
+
+    def test_gdrive_load_index(self):
+        """ Test FileListGdrive.load_index """
+        flist_cached = FileListGdrive(gdrive=self.gdrive)
+        self.assertEqual(flist_cached.load_index(self.index_file), 0)
+        self.get_filenames()
+        calls = dict(self.service.calls)
+
+        flist_cached = FileListGdrive(gdrive=self.gdrive)
+        self.assertEqual(flist_cached.load_index(self.index_file), 5)
+        self.assertEqual(dict(self.service.calls), calls)
+        self.assertEqual(
+            sorted(os.path.relpath(fn_, BASE_DIR) for fn_ in flist_cached.filelist),
+            ['a.txt', 'docs/b.txt', 'docs/c.txt'])
+        self.assertEqual(flist_cached.root_directory.gdriveid, 'root')
+        finfo = flist_cached.filelist_id_dict['b']
+        self.assertIs(finfo.gdrive, self.gdrive)
+        self.assertEqual((finfo.parentid, finfo.md5sum), ('docs', '%032x' % 5))
+
 if __name__ == '__main__':
     unittest.main()
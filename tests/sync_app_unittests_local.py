@@ -10,6 +10,8 @@ from __future__ import unicode_literals
 
 import os
 import hashlib
+import shutil
+import tempfile
 import unittest
 
 CURDIR = os.path.abspath(os.curdir)
@@ -17,8 +19,9 @@ os.sys.path.append(CURDIR)
 
 #from sync_app.sync_utils import get_md5
 from sync_app.file_cache import FileListCache
+from sync_app.file_cache_sqlite import FileListCacheSqlite
 from sync_app.file_info_local import FileInfoLocal
-from sync_app.file_list_local import FileListLocal
+from sync_app.file_list_local import FileListLocal, fill_file_lists
 
 TEST_FILE = 'tests/test_dir/hello_world.txt'
 TEST_DIR = 'tests/test_dir'
@@ -30,13 +33,14 @@ class TestSyncAppLocal(unittest.TestCase):
 
     def tearDown(self):
         """ remove temporary pickle file """
-        if os.path.exists('.tmp_file_list_cache.pkl.gz'):
-            os.remove('.tmp_file_list_cache.pkl.gz')
+        for fname in ('.tmp_file_list_cache.pkl.gz', '.tmp_file_list_cache.sqlite'):
+            if os.path.exists(fname):
+                os.remove(fname)
 
     def test_file_info_local(self):
         """ Test FileInfoLocal class """
         finfo = FileInfoLocal(fn=TEST_FILE)
-        output = '%s %s %s %d' % (finfo.filename, finfo.urlname, finfo.md5sum.result(),
+        output = '%s %s %s %d' % (finfo.filename, finfo.urlname, finfo.get_md5().result(),
                                   finfo.filestat.st_size)
         output = output.replace(CURDIR, '')
 
@@ -50,6 +54,7 @@ class TestSyncAppLocal(unittest.TestCase):
         """ Test FileListLocal class """
         flist = FileListLocal()
         flist.fill_file_list(directory=TEST_DIR)
+        flist.get_digests(('md5', ))
         output = []
         for fl_ in flist:
             temp_ = '%s %s %s %d' % (fl_.filename, fl_.urlname, fl_.md5sum, fl_.filestat.st_size)
@@ -67,6 +72,7 @@ class TestSyncAppLocal(unittest.TestCase):
         """ Test FileListCache class """
         flist = FileListLocal()
         flist.fill_file_list(directory=TEST_DIR)
+        flist.get_digests(('md5', ))
         fcache = FileListCache(pickle_file='.tmp_file_list_cache.pkl.gz')
         fcache.write_cache_file_list(flist)
         del flist, fcache
@@ -95,6 +101,174 @@ class TestSyncAppLocal(unittest.TestCase):
             'a2c60299334f38042bdfc49292d524a5'
         ])
 
+    def test_find_duplicates(self):
+        """ Test FileListLocal.find_duplicates """
+        tmpdir = tempfile.mkdtemp()
+        try:
+            shutil.copy(TEST_FILE, '%s/copy0.txt' % tmpdir)
+            shutil.copy(TEST_FILE, '%s/copy1.txt' % tmpdir)
+            with open('%s/other.txt' % tmpdir, 'w') as outfile:
+                outfile.write('hello world?\n')
+            shutil.copy('%s/goodbye_world.txt' % TEST_DIR, tmpdir)
+            flist = FileListLocal()
+            flist.fill_file_list(directory=tmpdir)
+            dupes = flist.find_duplicates()
+            self.assertEqual(list(dupes), ['8ddd8be4b179a529afa5f2ffae4b9858'])
+            self.assertEqual(
+                sorted(os.path.basename(x.filename) for x in dupes[list(dupes)[0]]),
+                ['copy0.txt', 'copy1.txt'])
+            self.assertEqual(flist.filelist['%s/goodbye_world.txt' % tmpdir].md5sum, '')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_file_list_cache_write_subtree(self):
+        """ Test writing the cache after loading a subtree keeps the entries outside of it """
+        flist = FileListLocal()
+        flist.fill_file_list(directory=TEST_DIR)
+        fcache = FileListCache(pickle_file='.tmp_file_list_cache.pkl.gz')
+        fcache.write_cache_file_list(flist)
+        names = sorted(x.filename for x in flist)
+
+        fcache = FileListCache(pickle_file='.tmp_file_list_cache.pkl.gz')
+        flist = fcache.get_cache_file_list(
+            file_info_class=FileInfoLocal, directory='%s/test_subdir' % TEST_DIR)
+        self.assertEqual(len(flist.filelist), 1)
+        fcache.write_cache_file_list(flist)
+
+        fcache = FileListCache(pickle_file='.tmp_file_list_cache.pkl.gz')
+        self.assertEqual(sorted(x.filename for x in fcache.get_cache_file_list()), names)
+
+    def test_file_list_cache_subtree(self):
+        """ Test FileListLocal only loads cache entries of the indexed subtree """
+        fcache = FileListCacheSqlite(sqlite_file='.tmp_file_list_cache.sqlite')
+        flist = FileListLocal(file_cache=fcache)
+        flist.fill_file_list(directory=TEST_DIR)
+        fcache.write_cache_file_list(flist)
+
+        fcache = FileListCacheSqlite(sqlite_file='.tmp_file_list_cache.sqlite')
+        flist = FileListLocal(file_cache=fcache, load_cache=True, hash_types=('sha1', ))
+        flist.fill_file_list(directory='%s/test_subdir' % TEST_DIR)
+        self.assertEqual([x.hash_types for x in flist], [('sha1', )])
+        self.assertEqual([os.path.basename(x) for x in flist.cache_file_list.filelist],
+                         ['whats_happening.txt'])
+        self.assertIs(flist.filelist[os.path.abspath('%s/test_subdir/whats_happening.txt' %
+                                                     TEST_DIR)],
+                      flist.cache_file_list.filelist[os.path.abspath(
+                          '%s/test_subdir/whats_happening.txt' % TEST_DIR)])
+        self.assertFalse(flist.load_cache_subtree('%s/test_subdir' % TEST_DIR))
+
+    def test_file_list_directory_mtime(self):
+        """ Test directories with unchanged mtime are taken from the cache unless paranoid """
+        tmpdir = tempfile.mkdtemp()
+        with open('%s/a.txt' % tmpdir, 'w') as outfile:
+            outfile.write('a')
+        fcache = FileListCacheSqlite(sqlite_file='.tmp_file_list_cache.sqlite')
+        flist = FileListLocal(file_cache=fcache, load_cache=True)
+        flist.fill_file_list(directory=tmpdir)
+        fcache.write_cache_file_list(flist, directory=[tmpdir])
+
+        dstat = os.stat(tmpdir)
+        with open('%s/b.txt' % tmpdir, 'w') as outfile:
+            outfile.write('b')
+        os.utime(tmpdir, ns=(dstat.st_atime_ns, dstat.st_mtime_ns))
+
+        def get_names(paranoid=False):
+            """ index tmpdir with a fresh cache connection """
+            flist = FileListLocal(
+                file_cache=FileListCacheSqlite(sqlite_file='.tmp_file_list_cache.sqlite'),
+                load_cache=True,
+                paranoid=paranoid)
+            flist.fill_file_list(directory=tmpdir)
+            return sorted(os.path.basename(x) for x in flist.filelist)
+
+        self.assertEqual(get_names(), ['a.txt'])
+        self.assertEqual(get_names(paranoid=True), ['a.txt', 'b.txt'])
+
+        os.utime(tmpdir, ns=(dstat.st_atime_ns, dstat.st_mtime_ns + 10**10))
+        self.assertEqual(get_names(), ['a.txt', 'b.txt'])
+        shutil.rmtree(tmpdir)
+
+    def test_file_list_directory_info_unchanged(self):
+        """ Test rows of unchanged directories aren't written again """
+        tmpdir = tempfile.mkdtemp()
+        try:
+            os.mkdir('%s/sub' % tmpdir)
+            for fname in ('a.txt', 'sub/b.txt'):
+                with open('%s/%s' % (tmpdir, fname), 'w') as outfile:
+                    outfile.write(fname)
+            written = []
+            for _ in range(2):
+                fcache = FileListCacheSqlite(sqlite_file='.tmp_file_list_cache.sqlite')
+                flist = FileListLocal(file_cache=fcache, load_cache=True)
+                flist.fill_file_list(directory=tmpdir)
+                fcache.write_cache_file_list(flist, directory=[tmpdir])
+                written.append(
+                    fcache.conn.execute('SELECT total_changes()').fetchone()[0])
+            self.assertEqual(written, [4, 0])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_fill_file_lists(self):
+        """ Test filling several lists with concurrent scanning threads """
+        flist0, flist1 = FileListLocal(), FileListLocal()
+        fill_file_lists(
+            [(flist0, TEST_DIR), (flist1, '%s/test_subdir' % TEST_DIR), (flist1, 'nonexistent')],
+            workers_per_device=2)
+        self.assertEqual(
+            sorted(os.path.basename(x) for x in flist0.filelist),
+            ['goodbye_world.txt', 'hello_world.txt', 'whats_happening.txt'])
+        self.assertEqual(list(flist1.filelist_name_dict), ['whats_happening.txt'])
+        self.assertEqual(flist0.directory_info[os.path.abspath(TEST_DIR)][2], ['test_subdir'])
+
+    def test_build_local_indexes_relpath(self):
+        """ Test lists of different roots are matched by path relative to their root """
+        from sync_app.file_sync import FileSync
+        from sync_app.sync_utils import build_local_indexes
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for disk in ('disk0', 'disk1'):
+                os.makedirs('%s/%s/sub' % (tmpdir, disk))
+                with open('%s/%s/sub/a.txt' % (tmpdir, disk), 'w') as outfile:
+                    outfile.write('same')
+            with open('%s/disk0/a.txt' % tmpdir, 'w') as outfile:
+                outfile.write('only on disk0')
+            fcache = FileListCacheSqlite(sqlite_file='.tmp_file_list_cache.sqlite')
+            flists = build_local_indexes([['%s/disk0' % tmpdir], ['%s/disk1' % tmpdir]],
+                                         fcache=fcache)
+            self.assertEqual([flist.basedir for flist in flists],
+                             ['%s/disk0' % tmpdir, '%s/disk1' % tmpdir])
+            self.assertEqual(sorted(flists[0].filelist_relpath_dict), ['a.txt', 'sub/a.txt'])
+            plan = FileSync(flists=flists).get_plan(match_relpath=True)
+            self.assertEqual([(action.action, action.finfo.filename) for action in plan],
+                             [('a_not_b', '%s/disk0/a.txt' % tmpdir)])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_file_list_hardlinks(self):
+        """ Test hardlinks are hashed once and take digests from cached links """
+        tmpdir = tempfile.mkdtemp()
+        with open('%s/a.txt' % tmpdir, 'w') as outfile:
+            outfile.write('hardlinked')
+        os.link('%s/a.txt' % tmpdir, '%s/b.txt' % tmpdir)
+        fcache = FileListCacheSqlite(sqlite_file='.tmp_file_list_cache.sqlite')
+        flist = FileListLocal(file_cache=fcache, load_cache=True)
+        flist.fill_file_list(directory=tmpdir)
+        finfo_a = flist.filelist['%s/a.txt' % tmpdir]
+        finfo_b = flist.filelist['%s/b.txt' % tmpdir]
+        self.assertIs(finfo_a.get_md5(), finfo_b.get_md5())
+        md5sum = hashlib.md5(b'hardlinked').hexdigest()
+        self.assertEqual(finfo_b.get_digests(('md5', ))['md5'], md5sum)
+        fcache.write_cache_file_list(flist, directory=[tmpdir])
+
+        os.link('%s/a.txt' % tmpdir, '%s/c.txt' % tmpdir)
+        flist = FileListLocal(
+            file_cache=FileListCacheSqlite(sqlite_file='.tmp_file_list_cache.sqlite'),
+            load_cache=True)
+        flist.fill_file_list(directory=tmpdir)
+        self.assertEqual(flist.filelist['%s/c.txt' % tmpdir].md5sum, md5sum)
+        shutil.rmtree(tmpdir)
+
 
 if __name__ == '__main__':
     unittest.main()